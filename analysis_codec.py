@@ -0,0 +1,194 @@
+"""Compact storage format for analysis_history.analysis_data
+
+An encoded value is PREFIX followed by base64 of a zlib-compressed blob:
+
+    uint32  mask of PACKED_FIELDS present
+    uint8   mask of TEXT_FIELDS present
+    uint16  one per packed field, value * scale
+    uint32  one per text field, id in assessment_texts
+    bytes   UTF-8 JSON of everything else
+
+Template assessment texts repeat across users, so each distinct one is stored
+once in assessment_texts. The model writes a new overall_assessment for every VIP
+analysis; those stay inline in the JSON part, so only free analyses store it by id.
+Values without the PREFIX are legacy JSON and decode as is.
+PACKED_FIELDS and TEXT_FIELDS are part of the format: only ever append to them.
+"""
+import base64
+import hashlib
+import json
+import struct
+import zlib
+
+from sqlalchemy import insert, select
+from models import AssessmentText, UPSERT_INSERTS
+
+PREFIX = "c1:"
+
+# (section, key, scale); traits in [0, 1] keep four decimals, VIP traits are integers
+PACKED_FIELDS = (
+    ('personality_traits', 'extraversion', 10000),
+    ('personality_traits', 'openness', 10000),
+    ('personality_traits', 'conscientiousness', 10000),
+    ('personality_traits', 'agreeableness', 10000),
+    ('personality_traits', 'confidence', 10000),
+    ('personality_traits', 'creativity', 10000),
+    ('personality_traits', 'leadership', 10000),
+    ('emotional_state', 'happiness', 10000),
+    ('emotional_state', 'calmness', 10000),
+    ('emotional_state', 'energy_level', 10000),
+    ('emotional_state', 'stress_level', 10000),
+    ('advanced_traits', 'intelligence_quotient', 1),
+    ('advanced_traits', 'emotional_intelligence', 1),
+    ('advanced_traits', 'charisma_level', 1),
+    ('advanced_traits', 'business_acumen', 1),
+    ('advanced_traits', 'artistic_talent', 1),
+    ('advanced_traits', 'leadership_potential', 1)
+)
+
+TEXT_FIELDS = (
+    'overall_assessment',
+    'vip_assessment',
+    'career_guidance',
+    'relationship_insights',
+    'success_factors'
+)
+
+# Text fields that only come from the local templates when the analysis was free
+FREE_ONLY_TEXT_FIELDS = frozenset({'overall_assessment'})
+
+_HEADER = struct.Struct('<IB')
+
+# assessment_texts rows never change, so lookups are cached for the life of the process
+_TEXT_CACHE_MAX_ENTRIES = 10000
+_text_ids = {}  # digest -> id
+_texts = {}  # id -> text
+
+def _remember_text(text_id: int, digest: str, text: str):
+    if len(_texts) >= _TEXT_CACHE_MAX_ENTRIES:
+        _texts.clear()
+        _text_ids.clear()
+    _text_ids[digest] = text_id
+    _texts[text_id] = text
+
+def _text_id(db, text: str) -> int:
+    """Id of the text in assessment_texts, inserting it the first time it is seen
+
+    Texts are written in their own committed transaction, so a cached id stays
+    valid even if the caller's transaction is rolled back.
+    """
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    text_id = _text_ids.get(digest)
+    if text_id is not None:
+        return text_id
+
+    query = select(AssessmentText.id).where(AssessmentText.digest == digest)
+    with db.get_bind().begin() as connection:
+        text_id = connection.scalar(query)
+        if text_id is None:
+            upsert = UPSERT_INSERTS.get(connection.dialect.name)
+            if upsert is not None:
+                # Another writer may insert the same text concurrently
+                connection.execute(upsert(AssessmentText).values(digest=digest, text=text)
+                                   .on_conflict_do_nothing(index_elements=[AssessmentText.digest]))
+                text_id = connection.scalar(query)
+            else:
+                result = connection.execute(insert(AssessmentText).values(digest=digest, text=text))
+                text_id = result.inserted_primary_key[0]
+
+    _remember_text(text_id, digest, text)
+    return text_id
+
+def _lookup_texts(db, text_ids) -> dict:
+    missing = [text_id for text_id in set(text_ids) if text_id not in _texts]
+    if missing:
+        for row in db.execute(select(AssessmentText.id, AssessmentText.digest, AssessmentText.text)
+                              .where(AssessmentText.id.in_(missing))):
+            _remember_text(row.id, row.digest, row.text)
+    return {text_id: _texts.get(text_id, '') for text_id in text_ids}
+
+def encode_analysis(db, analysis: dict, analysis_type: str) -> str:
+    """Encode an analysis result for analysis_history; db stores new template texts"""
+    rest = {key: dict(value) if isinstance(value, dict) else value for key, value in analysis.items()}
+
+    mask = 0
+    values = []
+    packed_sections = set()
+    for index, (section, key, scale) in enumerate(PACKED_FIELDS):
+        fields = rest.get(section)
+        if not isinstance(fields, dict) or key not in fields:
+            continue
+        value = fields[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if scale == 1 and not isinstance(value, int):
+            continue
+        scaled = round(value * scale)
+        if not 0 <= scaled <= 0xFFFF:
+            continue
+        mask |= 1 << index
+        values.append(scaled)
+        del fields[key]
+        packed_sections.add(section)
+
+    # Sections fully covered by packed values are rebuilt from them on decode
+    for section in packed_sections:
+        if not rest[section]:
+            del rest[section]
+
+    text_mask = 0
+    text_ids = []
+    for index, field in enumerate(TEXT_FIELDS):
+        if field in FREE_ONLY_TEXT_FIELDS and analysis_type != 'free':
+            continue
+        text = rest.get(field)
+        if isinstance(text, str) and text:
+            text_mask |= 1 << index
+            text_ids.append(_text_id(db, text))
+            del rest[field]
+
+    blob = b''.join((
+        _HEADER.pack(mask, text_mask),
+        struct.pack(f'<{len(values)}H', *values),
+        struct.pack(f'<{len(text_ids)}I', *text_ids),
+        json.dumps(rest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    ))
+    return PREFIX + base64.b64encode(zlib.compress(blob, 9)).decode('ascii')
+
+def decode_analysis(db, stored: str) -> dict:
+    """Decode an analysis_history value, compact or legacy JSON"""
+    if not stored.startswith(PREFIX):
+        return json.loads(stored)
+
+    blob = zlib.decompress(base64.b64decode(stored[len(PREFIX):]))
+    mask, text_mask = _HEADER.unpack_from(blob)
+    offset = _HEADER.size
+    value_count = bin(mask).count('1')
+    values = struct.unpack_from(f'<{value_count}H', blob, offset)
+    offset += 2 * value_count
+    text_count = bin(text_mask).count('1')
+    text_ids = struct.unpack_from(f'<{text_count}I', blob, offset)
+    offset += 4 * text_count
+
+    result = {}
+    packed_values = iter(values)
+    for index, (section, key, scale) in enumerate(PACKED_FIELDS):
+        if mask & (1 << index):
+            value = next(packed_values)
+            result.setdefault(section, {})[key] = value if scale == 1 else round(value / scale, 4)
+
+    for key, value in json.loads(blob[offset:].decode('utf-8')).items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key].update(value)
+        else:
+            result[key] = value
+
+    texts = _lookup_texts(db, text_ids)
+    present_fields = (field for index, field in enumerate(TEXT_FIELDS) if text_mask & (1 << index))
+    for field, text_id in zip(present_fields, text_ids):
+        result[field] = texts[text_id]
+    return result
+
+def encode_history_rows(db, rows: list) -> list:
+    """Copies of analysis_history row dicts with analysis_data encoded"""
+    return [dict(row, analysis_data=encode_analysis(db, row['analysis_data'], row['analysis_type'])) for row in rows]
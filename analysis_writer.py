@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from config import ANALYSIS_WRITE_BATCH_SIZE, ANALYSIS_WRITE_INTERVAL, ANALYSIS_WRITE_QUEUE_SIZE
+from async_models import save_analysis, save_analyses
+
+logger = logging.getLogger(__name__)
+
+class AnalysisWriter:
+    """Write-behind queue for analysis_history rows
+
+    save() only enqueues; a background task inserts the rows in bulk once
+    batch_size rows are waiting or flush_interval seconds have passed since the
+    first one. A full queue makes save() wait, so a slow database slows callers
+    down instead of growing memory. stop() writes out everything still queued.
+    """
+
+    def __init__(self, batch_size: int = ANALYSIS_WRITE_BATCH_SIZE,
+                 flush_interval: float = ANALYSIS_WRITE_INTERVAL, queue_size: int = ANALYSIS_WRITE_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.rows_written = 0
+        self.batches = 0
+        self.rows_failed = 0
+
+    def start(self):
+        """Start the background flush task, must be called on the running loop"""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def save(self, telegram_id: int, analysis_type: str, analysis: dict):
+        """Queue an analysis row, or write it directly when the writer isn't running"""
+        if self.task is None or self.task.done():
+            await save_analysis(telegram_id, analysis_type, analysis)
+            return
+        await self.queue.put({
+            'user_telegram_id': telegram_id,
+            'analysis_type': analysis_type,
+            'analysis_data': analysis,
+            'created_at': datetime.utcnow()
+        })
+
+    async def stop(self):
+        """Flush the queued rows and stop the background task"""
+        if self.task is None:
+            return
+        if not self.task.done():
+            await self.queue.put(None)
+            await self.task
+        self.task = None
+        logger.info(f"Analysis writer stopped: {self.rows_written} rows in {self.batches} batches, "
+                    f"{self.rows_failed} rows failed")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self.queue.get()
+            if row is None:
+                break
+
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        try:
+            await save_analyses(batch)
+        except Exception as e:
+            self.rows_failed += len(batch)
+            logger.error(f"Could not write {len(batch)} analysis rows: {e}")
+            return
+        self.rows_written += len(batch)
+        self.batches += 1
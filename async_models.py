@@ -0,0 +1,150 @@
+"""Async access to the bot's tables for use inside Telegram handlers
+
+Same schema as models.py, through SQLAlchemy's asyncio extension: asyncpg for
+PostgreSQL and aiosqlite for local SQLite databases.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from user_state_cache import user_state_cache
+from analysis_codec import encode_analysis, encode_history_rows
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+from models import (
+    DATABASE_URL,
+    User,
+    AnalysisHistory,
+    PhotoAnalysisCache,
+    UserState,
+    user_state_from_row,
+    user_state_select,
+    user_state_needs_write,
+    user_state_upsert,
+    get_user_state_fallback
+)
+
+def async_database_url(url: str):
+    """Map a sync DATABASE_URL to the matching async driver"""
+    url = make_url(url)
+    if url.get_backend_name() in ('postgres', 'postgresql'):
+        query = dict(url.query)
+        # asyncpg takes ssl= instead of libpq's sslmode=
+        if 'sslmode' in query:
+            query['ssl'] = query.pop('sslmode')
+        return url.set(drivername='postgresql+asyncpg', query=query)
+    if url.get_backend_name() == 'sqlite':
+        return url.set(drivername='sqlite+aiosqlite')
+    return url
+
+def _create_engine():
+    url = async_database_url(DATABASE_URL)
+    if url.get_backend_name() == 'sqlite':
+        return create_async_engine(url)
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
+
+async_engine = _create_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+async def get_user_state(telegram_id: int) -> UserState:
+    """دریافت یا ایجاد کاربر و وضعیت اشتراک او با یک کوئری"""
+    state = user_state_cache.get(telegram_id)
+    if state is not None:
+        return state
+
+    read_token = user_state_cache.read_token(telegram_id)
+    now = datetime.utcnow()
+    statement = user_state_upsert(async_engine.dialect.name, telegram_id, now)
+    async with AsyncSessionLocal() as db:
+        if statement is None:
+            state = await db.run_sync(get_user_state_fallback, telegram_id, now)
+        else:
+            # Existing users with a current state are a single read, no row is written
+            row = (await db.execute(user_state_select(telegram_id))).one_or_none()
+            if user_state_needs_write(row, now):
+                row = (await db.execute(statement)).one_or_none()
+                if row is None:
+                    # Another request already created the row or cleared the flag
+                    row = (await db.execute(user_state_select(telegram_id))).one()
+                await db.commit()
+            state = user_state_from_row(telegram_id, row.is_vip, row.vip_expires, row.free_analysis_used, now)
+    user_state_cache.put(state, read_token)
+    return state
+
+async def mark_free_analysis_used(telegram_id: int):
+    """علامت‌گذاری استفاده از تحلیل رایگان"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(User).where(User.telegram_id == telegram_id)
+            .values(free_analysis_used=True, last_analysis=datetime.utcnow())
+        )
+        await db.commit()
+    user_state_cache.invalidate(telegram_id)
+
+async def upgrade_to_vip(telegram_id: int):
+    """ارتقاء کاربر به VIP"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(User).where(User.telegram_id == telegram_id)
+            .values(is_vip=True, vip_expires=datetime.utcnow() + timedelta(days=30))
+        )
+        await db.commit()
+    user_state_cache.invalidate(telegram_id)
+
+async def save_analysis(telegram_id: int, analysis_type: str, analysis: dict):
+    """ذخیره تاریخچه تحلیل با قالب فشرده"""
+    async with AsyncSessionLocal() as db:
+        db.add(AnalysisHistory(
+            user_telegram_id=telegram_id,
+            analysis_type=analysis_type,
+            analysis_data=await db.run_sync(encode_analysis, analysis, analysis_type)
+        ))
+        await db.commit()
+
+async def save_analyses(rows: list):
+    """ذخیره گروهی تاریخچه تحلیل با یک insert؛ analysis_data هر ردیف یک dict است"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(AnalysisHistory), await db.run_sync(encode_history_rows, rows))
+        await db.commit()
+
+async def get_cached_analysis(file_unique_id: str, analysis_type: str, max_age_seconds: int):
+    """دریافت نتیجه ذخیره‌شده برای یک عکس تکراری"""
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(PhotoAnalysisCache.analysis_data).where(
+                PhotoAnalysisCache.file_unique_id == file_unique_id,
+                PhotoAnalysisCache.analysis_type == analysis_type,
+                PhotoAnalysisCache.created_at > datetime.utcnow() - timedelta(seconds=max_age_seconds)
+            ).limit(1)
+        )
+
+async def save_cached_analysis(file_unique_id: str, analysis_type: str, analysis_data: str):
+    """ذخیره نتیجه تحلیل یک عکس برای استفاده مجدد"""
+    async with AsyncSessionLocal() as db:
+        cached = await db.scalar(
+            select(PhotoAnalysisCache).where(
+                PhotoAnalysisCache.file_unique_id == file_unique_id,
+                PhotoAnalysisCache.analysis_type == analysis_type
+            )
+        )
+        if cached:
+            cached.analysis_data = analysis_data
+            cached.created_at = datetime.utcnow()
+        else:
+            db.add(PhotoAnalysisCache(
+                file_unique_id=file_unique_id,
+                analysis_type=analysis_type,
+                analysis_data=analysis_data
+            ))
+        await db.commit()
+
+async def dispose():
+    """Close pooled connections on shutdown"""
+    await async_engine.dispose()
@@ -0,0 +1,328 @@
+"""Local benchmarks for the bot's hot paths
+
+Usage:
+    python benchmarks.py detectors photo1.jpg photo2.jpg --backends haar dnn
+    (without --backends, every backend whose model files are present is compared)
+    python benchmarks.py heuristics --batch-size 10000
+    python benchmarks.py report --iterations 20000
+"""
+import argparse
+import random
+import statistics
+import time
+
+import cv2
+
+from face_analyzer import FaceAnalyzer
+from face_detectors import available_face_detectors
+from persian_utils import escape_markdown
+
+def _iou(a, b) -> float:
+    """Intersection over union of two (x, y, w, h) rectangles"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = inter_w * inter_h
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union else 0.0
+
+def _faces_agree(reference: list, candidate: list, min_iou: float) -> bool:
+    """Same number of faces and every reference face overlaps a candidate face"""
+    if len(reference) != len(candidate):
+        return False
+    return all(any(_iou(ref, cand) >= min_iou for cand in candidate) for ref in reference)
+
+def compare_detectors(image_paths: list, backends: list, repeat: int = 3, min_iou: float = 0.5) -> dict:
+    """Time each detector backend per image and measure agreement with the first backend"""
+    analyzers = {backend: FaceAnalyzer(detector_backend=backend) for backend in backends}
+    reference_backend = backends[0]
+    results = {backend: {'latencies_ms': [], 'agreements': 0, 'faces': []} for backend in backends}
+    images = 0
+
+    for path in image_paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"skip {path}: cannot decode")
+            continue
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        images += 1
+
+        row = [path]
+        faces_by_backend = {}
+        for backend, analyzer in analyzers.items():
+            image = img if analyzer.face_detector.uses_color else gray
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                faces = analyzer._find_faces(image)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            latency = statistics.median(timings)
+            results[backend]['latencies_ms'].append(latency)
+            faces_by_backend[backend] = faces
+            row.append(f"{backend}={latency:.1f}ms/{len(faces)} faces")
+
+        for backend in backends:
+            if _faces_agree(faces_by_backend[reference_backend], faces_by_backend[backend], min_iou):
+                results[backend]['agreements'] += 1
+
+        print("  ".join(row))
+
+    summary = {}
+    for backend, data in results.items():
+        latencies = data['latencies_ms']
+        summary[backend] = {
+            'images': images,
+            'median_ms': statistics.median(latencies) if latencies else 0.0,
+            'max_ms': max(latencies) if latencies else 0.0,
+            'agreement': data['agreements'] / images if images else 0.0
+        }
+    return summary
+
+def _run_detectors(args):
+    summary = compare_detectors(args.images, args.backends, args.repeat, args.min_iou)
+    print()
+    print(f"agreement is measured against '{args.backends[0]}' (IoU >= {args.min_iou})")
+    for backend, stats in summary.items():
+        print(f"{backend:>6}: median {stats['median_ms']:.1f}ms, max {stats['max_ms']:.1f}ms, "
+              f"agreement {stats['agreement']:.0%} over {stats['images']} images")
+
+def _synthetic_features(count: int, seed: int = 0) -> list:
+    """face_features dicts spread over the ranges the detector produces"""
+    rng = random.Random(seed)
+    return [{
+        'brightness': rng.uniform(30, 220),
+        'smile_detected': rng.random() < 0.4,
+        'face_width_height_ratio': rng.uniform(0.6, 1.5),
+        'eye_count': rng.choice([0, 1, 2])
+    } for _ in range(count)]
+
+def compare_heuristics(batch_size: int, repeat: int = 3, vip: bool = False) -> dict:
+    """Time the per-request heuristic analysis against the batch engine on the same features"""
+    from personality_analyzer import PersonalityAnalyzer
+    from heuristic_engine import HeuristicEngine
+
+    analyzer = PersonalityAnalyzer()
+    engine = HeuristicEngine(analyzer)
+    features = _synthetic_features(batch_size)
+    seeds = list(range(batch_size))
+
+    def scalar():
+        if vip:
+            return [analyzer._add_vip_sections(analyzer._get_simple_analysis(f), f) for f in features]
+        return [analyzer._get_simple_analysis(f) for f in features]
+
+    timings = {'scalar': [], 'batch': []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scalar_results = scalar()
+        timings['scalar'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch_results = engine.analyze_batch(features, seeds=seeds, vip=vip)
+        timings['batch'].append(time.perf_counter() - start)
+
+    def schema(result):
+        return {key: sorted(value) if isinstance(value, dict) else type(value).__name__
+                for key, value in result.items()}
+
+    return {
+        'batch_size': batch_size,
+        'scalar_s': statistics.median(timings['scalar']),
+        'batch_s': statistics.median(timings['batch']),
+        'same_schema': all(schema(a) == schema(b) for a, b in zip(scalar_results, batch_results)),
+        'reproducible': engine.analyze_batch(features, seeds=seeds, vip=vip) == batch_results
+    }
+
+def _run_heuristics(args):
+    stats = compare_heuristics(args.batch_size, args.repeat, args.vip)
+    scalar_rate = stats['batch_size'] / stats['scalar_s']
+    batch_rate = stats['batch_size'] / stats['batch_s']
+    print(f"scalar: {stats['scalar_s'] * 1000:.1f}ms ({scalar_rate:,.0f} analyses/s)")
+    print(f" batch: {stats['batch_s'] * 1000:.1f}ms ({batch_rate:,.0f} analyses/s), "
+          f"{batch_rate / scalar_rate:.1f}x")
+    print(f"same schema: {stats['same_schema']}, reproducible with seeds: {stats['reproducible']}")
+
+def _legacy_format_personality_report(analysis_data: dict) -> str:
+    """format_personality_report before the precomputed renderer, kept as the baseline
+
+    Escapes the same model-sourced text as the current renderer, so both produce the same report.
+    """
+    
+    personality_traits = analysis_data.get('personality_traits', {})
+    emotional_state = analysis_data.get('emotional_state', {})
+    overall_assessment = analysis_data.get('overall_assessment', '')
+    
+    report = "✨ **نتیجه تحلیل جادویی شخصیت شما!** 🎭\n\n"
+    
+    # Personality traits section
+    if personality_traits:
+        report += "🧠 **ویژگی‌های شخصیتی شما:**\n"
+        
+        trait_descriptions = {
+            'extraversion': '🎉 برون‌گرایی',
+            'openness': '🌈 انعطاف‌پذیری',
+            'conscientiousness': '📋 وظیفه‌شناسی',
+            'agreeableness': '🤝 توافق‌پذیری',
+            'neuroticism': '😟 نوروز‌گرایی',
+            'confidence': '💪 اعتماد به نفس',
+            'creativity': '🎨 خلاقیت',
+            'leadership': '👑 رهبری',
+            'empathy': '❤️ همدلی'
+        }
+        
+        for trait, value in personality_traits.items():
+            persian_name = trait_descriptions.get(trait) or escape_markdown(trait)
+            if isinstance(value, (int, float)):
+                percentage = int(value * 100) if value <= 1 else int(value)
+                report += f"• {persian_name}: {percentage}%\n"
+            else:
+                report += f"• {persian_name}: {escape_markdown(value)}\n"
+        
+        report += "\n"
+    
+    # Emotional state section
+    if emotional_state:
+        report += "😊 **وضعیت عاطفی:**\n"
+        
+        emotion_descriptions = {
+            'happiness': 'شادی',
+            'sadness': 'غم',
+            'anger': 'خشم',
+            'fear': 'ترس',
+            'surprise': 'تعجب',
+            'disgust': 'انزجار',
+            'neutral': 'خنثی',
+            'stress_level': 'سطح استرس',
+            'energy_level': 'سطح انرژی'
+        }
+        
+        for emotion, value in emotional_state.items():
+            persian_name = emotion_descriptions.get(emotion) or escape_markdown(emotion)
+            if isinstance(value, (int, float)):
+                percentage = int(value * 100) if value <= 1 else int(value)
+                report += f"• {persian_name}: {percentage}%\n"
+            else:
+                report += f"• {persian_name}: {escape_markdown(value)}\n"
+        
+        report += "\n"
+    
+    # Overall assessment
+    if overall_assessment:
+        report += "📝 **ارزیابی کلی:**\n"
+        report += f"{escape_markdown(overall_assessment)}\n\n"
+    
+    # VIP features if available
+    if 'advanced_traits' in analysis_data:
+        report += "🎯 **ویژگی‌های پیشرفته (VIP):**\n"
+        advanced_traits = analysis_data['advanced_traits']
+        
+        vip_descriptions = {
+            'intelligence_quotient': '🧠 ضریب هوشی',
+            'emotional_intelligence': '💝 هوش عاطفی', 
+            'charisma_level': '✨ جذابیت شخصی',
+            'business_acumen': '💼 هوش تجاری',
+            'artistic_talent': '🎨 استعداد هنری',
+            'leadership_potential': '👑 پتانسیل رهبری'
+        }
+        
+        for trait, value in advanced_traits.items():
+            persian_name = vip_descriptions.get(trait) or escape_markdown(trait)
+            report += f"• {persian_name}: {value}% \n"
+        
+        report += "\n"
+    
+    # Life patterns for VIP
+    if 'life_patterns' in analysis_data:
+        report += "🔮 **الگوهای زندگی (VIP):**\n"
+        life_patterns = analysis_data['life_patterns']
+        
+        pattern_descriptions = {
+            'risk_tolerance': '⚡ تحمل ریسک',
+            'decision_style': '🎯 سبک تصمیم‌گیری',
+            'social_preference': '👥 ترجیح اجتماعی',
+            'work_style': '💪 سبک کاری'
+        }
+        
+        for pattern, value in life_patterns.items():
+            persian_name = pattern_descriptions.get(pattern) or escape_markdown(pattern)
+            report += f"• {persian_name}: {value}\n"
+        
+        report += "\n"
+    
+    # VIP assessments
+    if 'career_guidance' in analysis_data:
+        report += "💼 **راهنمایی شغلی (VIP):**\n"
+        report += f"{analysis_data['career_guidance']}\n\n"
+    
+    if 'relationship_insights' in analysis_data:
+        report += "💕 **بینش روابط (VIP):**\n"
+        report += f"{analysis_data['relationship_insights']}\n\n"
+    
+    if 'success_factors' in analysis_data:
+        report += "🎯 **عوامل موفقیت (VIP):**\n"
+        report += f"{analysis_data['success_factors']}\n\n"
+    
+    # Disclaimer
+    if 'advanced_traits' in analysis_data:
+        report += "👑 **تبریک! شما عضو VIP هستید و از تحلیل‌های تخصصی بهره می‌برید.**\n\n"
+    
+    report += "⚠️ **توجه:** این تحلیل بر اساس ویژگی‌های ظاهری چهره انجام شده و صرفاً جنبه تفریحی دارد. برای ارزیابی دقیق شخصیت به متخصصان مراجعه کنید."
+    
+    return report
+
+def compare_report_rendering(iterations: int, vip: bool = True, repeat: int = 5) -> dict:
+    """Per-report render time of the legacy formatter and the current one on the same result"""
+    from heuristic_engine import HeuristicEngine
+    from personality_analyzer import PersonalityAnalyzer
+    from persian_utils import format_personality_report
+
+    analysis = HeuristicEngine(PersonalityAnalyzer()).analyze_batch(_synthetic_features(1), seeds=[0], vip=vip)[0]
+    assert _legacy_format_personality_report(analysis) == format_personality_report(analysis)
+    timings = {}
+    for name, render in (('legacy', _legacy_format_personality_report), ('current', format_personality_report)):
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                render(analysis)
+            runs.append((time.perf_counter() - start) / iterations)
+        timings[name] = statistics.median(runs)
+    return timings
+
+def _run_report(args):
+    timings = compare_report_rendering(args.iterations, not args.free, args.repeat)
+    for name, seconds in timings.items():
+        print(f"{name:>7}: {seconds * 1e6:.1f}us per report")
+    print(f"speedup: {timings['legacy'] / timings['current']:.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the personality bot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    detectors = subparsers.add_parser('detectors', help="compare face detector backends")
+    detectors.add_argument('images', nargs='+', help="image files to run the detectors on")
+    detectors.add_argument('--backends', nargs='+', default=available_face_detectors(),
+                           help="defaults to the backends available here, see fetch_face_models.py for dnn")
+    detectors.add_argument('--repeat', type=int, default=3, help="runs per image, the median is reported")
+    detectors.add_argument('--min-iou', type=float, default=0.5)
+    detectors.set_defaults(func=_run_detectors)
+
+    heuristics = subparsers.add_parser('heuristics', help="compare per-request and batch heuristic analysis")
+    heuristics.add_argument('--batch-size', type=int, default=10000)
+    heuristics.add_argument('--repeat', type=int, default=3, help="runs per path, the median is reported")
+    heuristics.add_argument('--vip', action='store_true', help="include the VIP sections")
+    heuristics.set_defaults(func=_run_heuristics)
+
+    report = subparsers.add_parser('report', help="compare the legacy and current report renderers")
+    report.add_argument('--iterations', type=int, default=20000)
+    report.add_argument('--repeat', type=int, default=5, help="runs per renderer, the median is reported")
+    report.add_argument('--free', action='store_true', help="render a free report instead of a VIP one")
+    report.set_defaults(func=_run_report)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
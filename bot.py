@@ -1,28 +1,29 @@
 import logging
 import asyncio
-import json
+import hashlib
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
-from config import BOT_TOKEN
-from face_analyzer import FaceAnalyzer
-from personality_analyzer import PersonalityAnalyzer
+from config import BOT_TOKEN, FREE_TIER_SKIP_EYE_DETECTION, MAX_IMAGE_SIZE, PHOTO_MIN_DETECTION_SIDE, STREAMING_ANALYSIS
+from detection_pool import DetectionPool
+from personality_analyzer import PersonalityAnalyzer, DEGRADED_KEY, split_degraded
 from persian_utils import (
     format_personality_report, 
+    split_message,
     get_error_message, 
-    get_welcome_message, 
-    get_processing_message,
-    get_subscription_offer_message,
-    get_vip_purchase_message,
-    get_already_used_free_message,
-    get_main_menu_keyboard,
-    get_help_message,
-    get_about_message,
-    get_support_message,
-    get_status_message
+    get_status_message,
+    MessageCatalog,
+    MENU_VIP,
+    MENU_STATUS
 )
 from rate_limiter import RateLimiter
-from models import get_user, is_user_vip, has_used_free_analysis, mark_free_analysis_used, save_analysis
+from memory_accounting import MemoryTracker
+from result_cache import ResultCache
+from single_flight import SingleFlight
+from user_state_cache import user_state_cache
+from message_editor import ThrottledEditor
+from async_models import get_user_state, mark_free_analysis_used, dispose as dispose_database
+from analysis_writer import AnalysisWriter
 from zarinpal import create_subscription_payment_link
 
 # Configure logging
@@ -32,21 +33,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def select_photo_size(photo_sizes, min_side: int = PHOTO_MIN_DETECTION_SIDE):
+    """Pick the smallest PhotoSize that is still large enough for reliable face detection"""
+    by_area = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for size in by_area:
+        if min(size.width, size.height) >= min_side:
+            return size
+    # Nothing is large enough, use the best we have
+    return by_area[-1]
+
 class PersonalityBot:
     def __init__(self):
-        self.face_analyzer = FaceAnalyzer()
+        self.detection_pool = DetectionPool()
         self.personality_analyzer = PersonalityAnalyzer()
         self.rate_limiter = RateLimiter()
+        self.result_cache = ResultCache()
+        self.analysis_flights = SingleFlight()
+        self.messages = MessageCatalog()
+        self.analysis_writer = AnalysisWriter()
+        # Menu buttons that need more than a fixed reply
+        self.menu_handlers = {
+            MENU_VIP: self.vip_command,
+            MENU_STATUS: self.status_reply
+        }
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         try:
-            welcome_message = get_welcome_message()
-            keyboard = get_main_menu_keyboard()
             await update.message.reply_text(
-                welcome_message, 
+                self.messages.welcome, 
                 parse_mode='Markdown',
-                reply_markup=keyboard
+                reply_markup=self.messages.main_menu_keyboard
             )
             logger.info(f"Start command from user {update.effective_user.id}")
         except Exception as e:
@@ -56,6 +73,7 @@ class PersonalityBot:
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo messages and perform personality analysis"""
         user_id = update.effective_user.id
+        memory = MemoryTracker(f"photo from user {user_id}")
         
         try:
             # Check rate limiting
@@ -65,70 +83,87 @@ class PersonalityBot:
                 await update.message.reply_text(error_msg)
                 return
             
-            # Get user from database
-            user = get_user(user_id)
-            is_vip = is_user_vip(user_id)
-            has_used_free = has_used_free_analysis(user_id)
+            # Get (or create) the user and their subscription state in one query
+            user_state = await get_user_state(user_id)
+            is_vip = user_state.is_vip
             
             # Check if user can use the service
-            if not is_vip and has_used_free:
+            if not user_state.can_analyze:
                 # User has used free analysis and is not VIP
-                await update.message.reply_text(get_already_used_free_message(), parse_mode='Markdown')
+                await update.message.reply_text(self.messages.already_used_free, parse_mode='Markdown')
                 return
             
-            # Send processing message
-            processing_msg = await update.message.reply_text(get_processing_message(), parse_mode='Markdown')
+            # Get the smallest photo size that is good enough for detection
+            photo = select_photo_size(update.message.photo)
             
-            # Get the largest photo
-            photo = update.message.photo[-1]
+            # Reject oversized files from metadata, before downloading anything
+            if photo.file_size and photo.file_size > MAX_IMAGE_SIZE:
+                await update.message.reply_text(get_error_message('file_too_large'))
+                return
+            
+            analysis_type = "vip" if is_vip else "free"
+            
+            # Same photo analyzed before: skip download, detection and analysis
+            cached_result = await self.result_cache.get(photo.file_unique_id, analysis_type)
+            if cached_result is not None:
+                logger.info(f"Result cache hit for user {user_id} (type: {analysis_type})")
+                await self._deliver_analysis(update, None, user_id, analysis_type, cached_result)
+                return
+            
+            # Send processing message
+            processing_msg = await update.message.reply_text(self.messages.processing, parse_mode='Markdown')
             
             # Download the photo
             photo_file = await photo.get_file()
             photo_bytes = await photo_file.download_as_bytearray()
+            memory.hold('download', len(photo_bytes))
             
-            logger.info(f"Processing photo from user {user_id}, size: {len(photo_bytes)} bytes")
+            logger.info(f"Processing photo from user {user_id}, {photo.width}x{photo.height}, size: {len(photo_bytes)} bytes")
             
-            # Analyze face and detect features
-            success, error_type, face_data = self.face_analyzer.detect_faces(bytes(photo_bytes))
+            # Analyze face and detect features (runs in the detection pool).
+            # The downloaded bytearray is handed over as is, no bytes() copy.
+            detect_eyes = is_vip or not FREE_TIER_SKIP_EYE_DETECTION
+            success, error_type, face_data = await self.detection_pool.detect_faces(
+                photo_bytes,
+                detect_eyes=detect_eyes,
+                include_image=is_vip
+            )
             
             if not success:
                 error_msg = get_error_message(error_type)
                 await processing_msg.edit_text(error_msg)
                 return
             
-            # Perform personality analysis
+            memory.add_peak(face_data.get('memory_peak_bytes', 0))
+            if face_data['base64_image']:
+                memory.hold('base64_image', len(face_data['base64_image']))
+            
+            # Perform personality analysis, sharing it with identical requests already in flight
             try:
-                if is_vip:
-                    # VIP analysis with full features
-                    analysis_result = self.personality_analyzer.get_vip_analysis(
-                        face_data['base64_image'], 
-                        face_data['face_features']
-                    )
-                    analysis_type = "vip"
-                else:
-                    # Free analysis (limited)
-                    analysis_result = self.personality_analyzer._get_simple_analysis(
-                        face_data['face_features']
-                    )
-                    analysis_type = "free"
-                    # Mark free analysis as used
-                    mark_free_analysis_used(user_id)
+                # VIP reports fill in section by section while the model streams
+                editor = ThrottledEditor(processing_msg)
                 
-                # Save analysis to database
-                save_analysis(user_id, analysis_type, json.dumps(analysis_result))
+                def on_partial(partial_result):
+                    # Edits happen in the editor's background task, not in the model's stream loop
+                    editor.submit(split_message(format_personality_report(partial_result))[0])
                 
-                # Format and send the personality report
-                report = format_personality_report(analysis_result)
-                await processing_msg.edit_text(report, parse_mode='Markdown')
+                streaming = STREAMING_ANALYSIS and analysis_type == "vip"
+                flight_key = f"{hashlib.sha256(photo_bytes).hexdigest()}:{analysis_type}"
+                analysis_result = await self.analysis_flights.do(
+                    flight_key, self._analyze, analysis_type, face_data, on_partial if streaming else None
+                )
                 
-                # If this was a free analysis, offer subscription
-                if analysis_type == "free":
-                    await update.message.reply_text(get_subscription_offer_message(), parse_mode='Markdown')
+                # Stand-ins for a failed model call are not cached, resending the photo retries it
+                if not analysis_result.get(DEGRADED_KEY):
+                    await self.result_cache.put(photo.file_unique_id, analysis_type, analysis_result)
+                await self._deliver_analysis(update, editor, user_id, analysis_type, analysis_result,
+                                             face_data['face_features'])
                 
                 logger.info(f"Successfully analyzed photo for user {user_id} (type: {analysis_type})")
                 
             except Exception as e:
                 logger.error(f"Personality analysis error for user {user_id}: {e}")
+                editor.cancel()
                 error_msg = get_error_message('analysis_failed')
                 await processing_msg.edit_text(error_msg)
         
@@ -139,72 +174,89 @@ class PersonalityBot:
                 await update.message.reply_text(error_msg)
             except:
                 pass  # Avoid secondary errors
+        finally:
+            memory.report()
+    
+    async def _analyze(self, analysis_type: str, face_data: dict, on_partial=None) -> dict:
+        """Run the analysis for the given tier"""
+        if analysis_type == "vip":
+            # VIP analysis with full features
+            return await self.personality_analyzer.get_vip_analysis_async(
+                face_data['base64_image'], 
+                face_data['face_features'],
+                on_partial
+            )
+        
+        # Free analysis (limited)
+        return self.personality_analyzer._get_simple_analysis(face_data['face_features'])
+    
+    async def _deliver_analysis(self, update: Update, editor, user_id: int, analysis_type: str,
+                                analysis_result: dict, face_features: dict = None):
+        """Record the analysis for the user and send the report"""
+        # Mark free analysis as used
+        if analysis_type == "free":
+            await mark_free_analysis_used(user_id)
+        
+        # Save analysis to database, with the face features so it can be re-scored offline.
+        # The degraded marker is kept there so re-analysis can tell stand-ins apart.
+        history_record = dict(analysis_result)
+        if face_features:
+            history_record['face_features'] = face_features
+        await self.analysis_writer.save(user_id, analysis_type, history_record)
+        analysis_result, _ = split_degraded(analysis_result)
+        
+        # Format and send the personality report, continuing in new messages past Telegram's limit
+        first_part, *other_parts = split_message(format_personality_report(analysis_result))
+        if editor:
+            await editor.finish(first_part)
+        else:
+            await update.message.reply_text(first_part, parse_mode='Markdown')
+        for part in other_parts:
+            await update.message.reply_text(part, parse_mode='Markdown')
+        
+        # If this was a free analysis, offer subscription
+        if analysis_type == "free":
+            await update.message.reply_text(self.messages.subscription_offer, parse_mode='Markdown')
     
     async def handle_other_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle menu button messages"""
         try:
             message_text = update.message.text
-            user_id = update.effective_user.id
             
-            if message_text == "📸 تحلیل شخصیت":
-                help_message = """📸 **آماده تحلیل شخصیت هستید!** ✨
-
-🎯 **مراحل انجام:**
-📷 عکس واضح از چهره‌تان بفرستید
-✨ مطمئن شوید عکس با کیفیت و روشن باشد
-👤 فقط یک چهره در تصویر باشد
-
-🚀 **الان عکستان را بفرستید!** 💫"""
-                
-            elif message_text == "👑 اشتراک VIP":
-                await self.vip_command(update, context)
+            handler = self.menu_handlers.get(message_text)
+            if handler:
+                await handler(update, context)
                 return
-                
-            elif message_text == "📊 وضعیت من":
-                user = get_user(user_id)
-                is_vip = is_user_vip(user_id)
-                has_used_free = has_used_free_analysis(user_id)
-                # Get vip_expires from user model if needed
-                help_message = get_status_message(is_vip, has_used_free)
-                
-            elif message_text == "❓ راهنما":
-                help_message = get_help_message()
-                
-            elif message_text == "🎯 درباره ربات":
-                help_message = get_about_message()
-                
-            elif message_text == "📞 پشتیبانی":
-                help_message = get_support_message()
-                
-            else:
-                help_message = """📱 **از منوی زیر انتخاب کنید:** 👇
-
-💡 روی دکمه‌های منو کلیک کنید تا به بخش مورد نظر بروید."""
             
-            keyboard = get_main_menu_keyboard()
             await update.message.reply_text(
-                help_message, 
+                self.messages.menu_replies.get(message_text, self.messages.menu_hint), 
                 parse_mode='Markdown',
-                reply_markup=keyboard
+                reply_markup=self.messages.main_menu_keyboard
             )
         except Exception as e:
             logger.error(f"Error handling other messages: {e}")
     
+    async def status_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Answer the status menu button with the user's subscription state"""
+        user_state = await get_user_state(update.effective_user.id)
+        await update.message.reply_text(
+            get_status_message(user_state.is_vip, user_state.free_analysis_used, user_state.vip_expires), 
+            parse_mode='Markdown',
+            reply_markup=self.messages.main_menu_keyboard
+        )
+    
     async def vip_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /vip command for subscription purchase"""
         user_id = update.effective_user.id
         
         try:
             # Check if user is already VIP
-            if is_user_vip(user_id):
-                await update.message.reply_text(
-                    "👑 **شما الان عضو VIP هستید!** ✨\n\n📸 می‌تونید عکس‌هاتون رو بفرستید و از تحلیل‌های کامل استفاده کنید! 💎",
-                    parse_mode='Markdown'
-                )
+            if (await get_user_state(user_id)).is_vip:
+                await update.message.reply_text(self.messages.already_vip, parse_mode='Markdown')
                 return
             
             # Send purchase message
-            await update.message.reply_text(get_vip_purchase_message(), parse_mode='Markdown')
+            await update.message.reply_text(self.messages.vip_purchase, parse_mode='Markdown')
             
             # Create payment link
             success, payment_link = create_subscription_payment_link(user_id)
@@ -228,6 +280,19 @@ class PersonalityBot:
                 "❌ **خطایی رخ داد!**\n\n🔄 لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید.",
                 parse_mode='Markdown'
             )
+    
+    async def startup(self, application: Application):
+        """Start background tasks once the application's event loop is running"""
+        self.analysis_writer.start()
+    
+    async def shutdown(self, application: Application):
+        """Release background workers and database connections when the application stops"""
+        self.detection_pool.shutdown()
+        await self.analysis_writer.stop()
+        await dispose_database()
+        logger.info(f"User state cache: {user_state_cache.stats()}")
+        if self.personality_analyzer.response_cache:
+            logger.info(f"Vision response cache: {self.personality_analyzer.response_cache.stats()}")
 
 def main():
     """Main function to run the bot"""
@@ -236,7 +301,13 @@ def main():
         bot = PersonalityBot()
         
         # Build application
-        application = Application.builder().token(BOT_TOKEN).build()
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(bot.startup)
+            .post_shutdown(bot.shutdown)
+            .build()
+        )
         
         # Add handlers
         application.add_handler(CommandHandler("start", bot.start_command))
@@ -0,0 +1,96 @@
+import logging
+import time
+from collections import deque
+from config import (
+    CIRCUIT_WINDOW,
+    CIRCUIT_MIN_CALLS,
+    CIRCUIT_FAILURE_RATE,
+    CIRCUIT_SLOW_RATE,
+    CIRCUIT_LATENCY_SLO,
+    CIRCUIT_OPEN_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Stops calling a dependency whose recent calls fail or miss the latency SLO too often
+
+    closed: calls go through and their outcomes are recorded in a sliding window.
+    open: calls are refused until open_seconds have passed.
+    half_open: a single probe call is let through; its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window: int = CIRCUIT_WINDOW, min_calls: int = CIRCUIT_MIN_CALLS,
+                 failure_rate: float = CIRCUIT_FAILURE_RATE, slow_rate: float = CIRCUIT_SLOW_RATE,
+                 latency_slo: float = CIRCUIT_LATENCY_SLO, open_seconds: float = CIRCUIT_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.latency_slo = latency_slo
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.calls = deque(maxlen=window)  # (succeeded, latency_seconds)
+        self.opened_at = 0.0
+        self.probe_started_at = None
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.open_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuit '{self.name}' half-open, sending a probe")
+
+        # Half-open: one probe at a time, but don't wait forever on a probe that never reported
+        if self.probe_started_at is not None and now - self.probe_started_at < self.open_seconds:
+            return False
+        self.probe_started_at = now
+        return True
+
+    def record_success(self, latency: float):
+        if self.state == self.HALF_OPEN:
+            if latency <= self.latency_slo:
+                self._close()
+            else:
+                self._open(f"probe took {latency:.1f}s")
+            return
+        self.calls.append((True, latency))
+        self._evaluate()
+
+    def record_failure(self):
+        if self.state == self.HALF_OPEN:
+            self._open("probe failed")
+            return
+        self.calls.append((False, None))
+        self._evaluate()
+
+    def _evaluate(self):
+        if self.state != self.CLOSED or len(self.calls) < self.min_calls:
+            return
+        failures = sum(1 for succeeded, _ in self.calls if not succeeded)
+        slow = sum(1 for succeeded, latency in self.calls if succeeded and latency > self.latency_slo)
+        if failures / len(self.calls) >= self.failure_rate:
+            self._open(f"{failures}/{len(self.calls)} recent calls failed")
+        elif slow / len(self.calls) >= self.slow_rate:
+            self._open(f"{slow}/{len(self.calls)} recent calls slower than {self.latency_slo}s")
+
+    def _open(self, reason: str):
+        logger.warning(f"Circuit '{self.name}' opened: {reason}")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probe_started_at = None
+
+    def _close(self):
+        logger.info(f"Circuit '{self.name}' closed, dependency recovered")
+        self.state = self.CLOSED
+        self.calls.clear()
+        self.probe_started_at = None
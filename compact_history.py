@@ -0,0 +1,158 @@
+"""Compaction and retention for analysis_history and photo_analysis_cache
+
+Deletes rows older than the retention window, then rewrites the remaining
+legacy JSON rows in the compact analysis_codec format. Also drops expired
+photo_analysis_cache rows and the oldest ones past RESULT_CACHE_DB_MAX_ROWS.
+Every step works one chunk per transaction so the job can run next to the bot.
+Reports the bytes saved.
+
+Usage:
+    python compact_history.py
+    python compact_history.py --retention-days 180 --chunk-size 1000
+    python compact_history.py --dry-run
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from config import ANALYSIS_HISTORY_RETENTION_DAYS, RESULT_CACHE_TTL, RESULT_CACHE_DB_MAX_ROWS
+from models import SessionLocal, AnalysisHistory, PhotoAnalysisCache
+from analysis_codec import PREFIX, encode_analysis
+
+def enforce_retention(retention_days: int, chunk_size: int, dry_run: bool = False) -> dict:
+    """Delete rows older than retention_days in chunks, returns the rows and bytes removed"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    stats = {'rows': 0, 'bytes': 0}
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                AnalysisHistory.id,
+                func.coalesce(func.length(AnalysisHistory.analysis_data), 0).label('size')
+            ).filter(
+                AnalysisHistory.id > last_id,
+                AnalysisHistory.created_at < cutoff
+            ).order_by(AnalysisHistory.id).limit(chunk_size).all()
+            if not rows:
+                return stats
+
+            stats['rows'] += len(rows)
+            stats['bytes'] += sum(row.size for row in rows)
+            if not dry_run:
+                db.query(AnalysisHistory).filter(
+                    AnalysisHistory.id.in_([row.id for row in rows])
+                ).delete(synchronize_session=False)
+                db.commit()
+        finally:
+            db.close()
+        last_id = rows[-1].id
+
+def compact_rows(chunk_size: int, dry_run: bool = False) -> dict:
+    """Re-encode legacy JSON rows in chunks, returns sizes before and after"""
+    stats = {'rows': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0}
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.query(AnalysisHistory.id, AnalysisHistory.analysis_type, AnalysisHistory.analysis_data).filter(
+                AnalysisHistory.id > last_id,
+                ~AnalysisHistory.analysis_data.startswith(PREFIX)
+            ).order_by(AnalysisHistory.id).limit(chunk_size).all()
+            if not rows:
+                return stats
+
+            updates = []
+            for row in rows:
+                try:
+                    analysis = json.loads(row.analysis_data)
+                except (TypeError, ValueError):
+                    stats['skipped'] += 1
+                    continue
+                encoded = encode_analysis(db, analysis, row.analysis_type)
+                stats['rows'] += 1
+                stats['bytes_before'] += len(row.analysis_data.encode('utf-8'))
+                stats['bytes_after'] += len(encoded)
+                updates.append({'id': row.id, 'analysis_data': encoded})
+
+            if dry_run:
+                db.rollback()
+            else:
+                if updates:
+                    db.execute(update(AnalysisHistory), updates)
+                db.commit()
+        finally:
+            db.close()
+        last_id = rows[-1].id
+
+def _delete_cache_rows(query_ids, chunk_size: int, limit: int = None) -> int:
+    """Delete photo_analysis_cache rows chosen by query_ids(db), one chunk per transaction"""
+    removed = 0
+    while limit is None or removed < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - removed)
+        db = SessionLocal()
+        try:
+            ids = [row.id for row in query_ids(db).limit(size)]
+            if not ids:
+                break
+            db.query(PhotoAnalysisCache).filter(PhotoAnalysisCache.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        removed += len(ids)
+    return removed
+
+def prune_result_cache(ttl: int, max_rows: int, chunk_size: int, dry_run: bool = False) -> dict:
+    """Delete expired photo_analysis_cache rows, then the oldest ones past max_rows"""
+    expired = PhotoAnalysisCache.created_at < datetime.utcnow() - timedelta(seconds=ttl)
+    db = SessionLocal()
+    try:
+        total = db.query(func.count(PhotoAnalysisCache.id)).scalar()
+        expired_rows = db.query(func.count(PhotoAnalysisCache.id)).filter(expired).scalar()
+    finally:
+        db.close()
+    stats = {'expired': expired_rows, 'over_cap': max(0, total - expired_rows - max_rows)}
+    if dry_run:
+        return stats
+
+    stats['expired'] = _delete_cache_rows(lambda db: db.query(PhotoAnalysisCache.id).filter(expired), chunk_size)
+    stats['over_cap'] = _delete_cache_rows(
+        lambda db: db.query(PhotoAnalysisCache.id).order_by(PhotoAnalysisCache.created_at, PhotoAnalysisCache.id),
+        chunk_size,
+        stats['over_cap']
+    )
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact analysis_history and enforce retention windows")
+    parser.add_argument('--retention-days', type=int, default=ANALYSIS_HISTORY_RETENTION_DAYS)
+    parser.add_argument('--cache-max-rows', type=int, default=RESULT_CACHE_DB_MAX_ROWS,
+                        help="photo_analysis_cache rows kept, oldest are deleted first")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true',
+                        help="report what would change; only new template texts are stored")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    removed = enforce_retention(args.retention_days, args.chunk_size, args.dry_run)
+    compacted = compact_rows(args.chunk_size, args.dry_run)
+    pruned = prune_result_cache(RESULT_CACHE_TTL, args.cache_max_rows, args.chunk_size, args.dry_run)
+    elapsed = time.perf_counter() - started
+
+    saved = compacted['bytes_before'] - compacted['bytes_after']
+    ratio = compacted['bytes_after'] / compacted['bytes_before'] if compacted['bytes_before'] else 0.0
+    prefix = "would have " if args.dry_run else ""
+    print(f"retention: {prefix}deleted {removed['rows']} rows older than {args.retention_days} days "
+          f"({removed['bytes']:,} bytes)")
+    print(f"compaction: {prefix}re-encoded {compacted['rows']} rows, {compacted['bytes_before']:,} -> "
+          f"{compacted['bytes_after']:,} bytes ({ratio:.0%}), saved {saved:,} bytes; "
+          f"skipped {compacted['skipped']} unreadable rows")
+    print(f"result cache: {prefix}deleted {pruned['expired']} expired rows and "
+          f"{pruned['over_cap']} rows over the {args.cache_max_rows} row cap")
+    print(f"total {prefix}freed: {removed['bytes'] + saved:,} bytes in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,24 @@ import os
 BOT_TOKEN = os.getenv("7538244929:AAG8moGzCUlkxo8Oy06WiQhQZbAkyDVguao" "YOUR_BOT_TOKEN_HERE")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
 
+# Async database connection pool (PostgreSQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # extra connections under bursts
+DB_POOL_TIMEOUT = 5  # seconds to wait for a free connection
+DB_POOL_RECYCLE = 1800  # seconds before a connection is replaced
+
+# In-process cache of users' VIP and free-usage state
+USER_STATE_CACHE_MAX_ENTRIES = 10000
+USER_STATE_CACHE_TTL = 120  # seconds, also the delay before an upgrade made elsewhere is seen
+
+# Write-behind queue for analysis_history rows
+ANALYSIS_WRITE_BATCH_SIZE = 50  # rows per bulk insert
+ANALYSIS_WRITE_INTERVAL = 1.0  # seconds a queued row waits at most before it is written
+ANALYSIS_WRITE_QUEUE_SIZE = 1000  # queued rows before save() waits for the writer
+
+# analysis_history rows older than this are deleted by compact_history.py
+ANALYSIS_HISTORY_RETENTION_DAYS = int(os.getenv("ANALYSIS_HISTORY_RETENTION_DAYS", "365"))
+
 # Rate limiting configuration
 RATE_LIMIT_WINDOW = 60  # seconds
 RATE_LIMIT_MAX_REQUESTS = 5  # max requests per window per user
@@ -11,3 +29,72 @@ RATE_LIMIT_MAX_REQUESTS = 5  # max requests per window per user
 # Image processing configuration
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
 SUPPORTED_FORMATS = ['JPEG', 'JPG', 'PNG', 'WEBP']
+
+# Face detection executor configuration
+FACE_DETECTION_EXECUTOR = os.getenv("FACE_DETECTION_EXECUTOR", "process")  # process, thread, inline
+FACE_DETECTION_WORKERS = int(os.getenv("FACE_DETECTION_WORKERS", "2"))
+FACE_DETECTION_QUEUE_SIZE = 16  # max detection jobs queued or running at once
+FACE_DETECTION_TIMEOUT = 20  # seconds per detection job
+FACE_DETECTION_MAX_EDGE = 640  # longest edge of the copy the face cascade runs on, 0 = full resolution
+FREE_TIER_SKIP_EYE_DETECTION = True  # free analyses only use brightness, smile and face ratio
+FACE_BATCH_MAX_SIZE = 8  # detection jobs dispatched together, 1 disables micro-batching
+FACE_BATCH_MAX_WAIT_MS = 5  # how long the first job in a batch waits for company
+
+# Face detector backend: haar (OpenCV cascades) or dnn (ResNet-10 SSD on cv2.dnn)
+FACE_DETECTOR_BACKEND = os.getenv("FACE_DETECTOR_BACKEND", "haar")  # dnn needs python fetch_face_models.py first
+DNN_FACE_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_models")
+DNN_FACE_PROTOTXT = os.path.join(DNN_FACE_MODEL_DIR, "deploy.prototxt")
+DNN_FACE_MODEL = os.path.join(DNN_FACE_MODEL_DIR, "res10_300x300_ssd_iter_140000_fp16.caffemodel")
+DNN_FACE_CONFIDENCE = 0.6
+
+# Image quality pre-gate, measured on a small grayscale thumbnail
+QUALITY_GATE_ENABLED = True
+QUALITY_THUMBNAIL_EDGE = 256  # longest edge of the thumbnail in pixels
+QUALITY_MIN_SHARPNESS = 15.0  # variance of the Laplacian, lower means blurry
+QUALITY_MIN_BRIGHTNESS = 35  # mean gray level, lower means too dark
+QUALITY_MAX_BRIGHTNESS = 225  # mean gray level, higher means overexposed
+QUALITY_MIN_FACE_AREA_RATIO = 0.01  # face box area / image area
+
+# Telegram photo size selection
+PHOTO_MIN_DETECTION_SIDE = 480  # smallest side (px) of the PhotoSize we download for face detection
+
+# Analysis result cache keyed by Telegram file_unique_id
+RESULT_CACHE_MAX_ENTRIES = 2000
+RESULT_CACHE_TTL = 24 * 60 * 60  # seconds
+RESULT_CACHE_USE_DATABASE = os.getenv("RESULT_CACHE_USE_DATABASE", "false").lower() == "true"
+RESULT_CACHE_DB_MAX_ROWS = 100000  # photo_analysis_cache rows kept by compact_history.py, oldest go first
+
+# OpenAI vision calls (async path)
+OPENAI_MAX_CONCURRENCY = 4  # concurrent vision calls per process
+OPENAI_TIMEOUT = 15  # seconds per call, must leave room for a retry within ANALYSIS_LATENCY_BUDGET
+OPENAI_MAX_RETRIES = 2  # retries after the first attempt, for transient errors only
+OPENAI_RETRY_BASE_DELAY = 1.0  # seconds, doubled on every retry and jittered
+
+# Image payload sent to the vision model
+VISION_PAYLOAD_MODE = os.getenv("VISION_PAYLOAD_MODE", "face_crop")  # face_crop or full
+VISION_FACE_MARGIN = 0.4  # margin around the face box, as a fraction of its size on each side
+VISION_MAX_EDGE = 512  # longest edge of the cropped payload in pixels
+VISION_JPEG_QUALITY = 85
+VISION_IMAGE_DETAIL = "low"  # low, high or auto
+
+# Persistent cache of vision model results
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "vision_cache.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024  # stored result size before LRU eviction
+RESPONSE_CACHE_TTL = 30 * 24 * 60 * 60  # seconds
+
+# Progressive report edits while the vision model streams its answer
+STREAMING_ANALYSIS = os.getenv("STREAMING_ANALYSIS", "true").lower() == "true"
+TELEGRAM_EDIT_INTERVAL = 1.5  # minimum seconds between edits of the same message
+
+# Reports longer than Telegram's message limit are sent as several messages
+TELEGRAM_MESSAGE_LIMIT = 4096  # characters
+
+# Circuit breaker around the vision model
+ANALYSIS_LATENCY_BUDGET = 35  # seconds a request may spend on the model, covers a timed-out call and one retry
+CIRCUIT_WINDOW = 20  # recent calls considered
+CIRCUIT_MIN_CALLS = 5  # calls needed in the window before the circuit can open
+CIRCUIT_FAILURE_RATE = 0.5  # open when this share of recent calls failed
+CIRCUIT_SLOW_RATE = 0.5  # open when this share of recent calls missed the latency SLO
+CIRCUIT_LATENCY_SLO = 12  # seconds
+CIRCUIT_OPEN_SECONDS = 30  # time before a half-open probe is allowed
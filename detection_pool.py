@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import (
+    FACE_DETECTION_EXECUTOR,
+    FACE_DETECTION_WORKERS,
+    FACE_DETECTION_QUEUE_SIZE,
+    FACE_DETECTION_TIMEOUT,
+    FACE_BATCH_MAX_SIZE,
+    FACE_BATCH_MAX_WAIT_MS
+)
+from face_analyzer import FaceAnalyzer
+
+logger = logging.getLogger(__name__)
+
+# Each worker (process or thread) keeps its own FaceAnalyzer, built once
+_worker_state = threading.local()
+
+def _init_worker():
+    """Build the FaceAnalyzer for this worker"""
+    _worker_state.analyzer = FaceAnalyzer()
+
+def _detect_in_worker(image_bytes: bytes, options: dict) -> tuple[bool, str, dict]:
+    """Run face detection with the worker's FaceAnalyzer"""
+    return _worker_state.analyzer.detect_faces(image_bytes, **options)
+
+def _detect_batch_in_worker(jobs: list) -> list:
+    """Run several detection jobs back to back with the worker's warm FaceAnalyzer"""
+    return [_worker_state.analyzer.detect_faces(image_bytes, **options) for image_bytes, options in jobs]
+
+class BatchMetrics:
+    """Throughput and batching delay of the micro-batched detection scheduler"""
+
+    def __init__(self, log_every: int = 100):
+        self.started_at = time.monotonic()
+        self.log_every = log_every
+        self.jobs = 0
+        self.batches = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_batch(self, wait_times: list):
+        self.batches += 1
+        self.jobs += len(wait_times)
+        self.total_wait += sum(wait_times)
+        self.max_wait = max(self.max_wait, max(wait_times))
+        if self.jobs // self.log_every != (self.jobs - len(wait_times)) // self.log_every:
+            logger.info(f"Face detection batching: {self.snapshot()}")
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            'jobs': self.jobs,
+            'batches': self.batches,
+            'jobs_per_second': round(self.jobs / elapsed, 2),
+            'avg_batch_size': round(self.jobs / self.batches, 2) if self.batches else 0.0,
+            'avg_batch_wait_ms': round(self.total_wait / self.jobs * 1000, 2) if self.jobs else 0.0,
+            'max_batch_wait_ms': round(self.max_wait * 1000, 2)
+        }
+
+class DetectionPool:
+    """Runs FaceAnalyzer.detect_faces off the event loop"""
+
+    def __init__(self, mode: str = FACE_DETECTION_EXECUTOR, workers: int = FACE_DETECTION_WORKERS,
+                 queue_size: int = FACE_DETECTION_QUEUE_SIZE, timeout: float = FACE_DETECTION_TIMEOUT,
+                 batch_max_size: int = FACE_BATCH_MAX_SIZE, batch_max_wait_ms: float = FACE_BATCH_MAX_WAIT_MS):
+        if mode not in ('process', 'thread', 'inline'):
+            raise ValueError(f"Unknown face detection executor: {mode}")
+
+        self.mode = mode
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.pending_jobs = 0
+        self.batch_max_size = batch_max_size
+        self.batch_max_wait = batch_max_wait_ms / 1000
+        self.batch_metrics = BatchMetrics()
+        self._batch = []
+        self._batch_timer = None
+        self._executor = None
+        # Built here even when workers do the detection, so a bad detector backend
+        # (unknown name, missing model files) fails at startup instead of in every worker
+        analyzer = FaceAnalyzer()
+        self._analyzer = analyzer if mode == 'inline' else None
+        self._start_executor()
+
+    def _start_executor(self):
+        if self.mode == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        elif self.mode == 'thread':
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                thread_name_prefix='face-detect'
+            )
+
+    def _release_slot(self):
+        self.pending_jobs -= 1
+
+    def _schedule_release(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._release_slot)
+        except RuntimeError:
+            pass  # Event loop already closed during shutdown
+
+    async def detect_faces(self, image_bytes: bytes, **options) -> tuple[bool, str, dict]:
+        """Detect faces without blocking the event loop"""
+        if self.mode == 'inline':
+            return self._analyzer.detect_faces(image_bytes, **options)
+
+        # Bounded queue: reject instead of piling up work we can't finish in time
+        if self.pending_jobs >= self.queue_size:
+            logger.warning(f"Face detection queue full ({self.pending_jobs} jobs), rejecting request")
+            return False, 'server_busy', {}
+
+        if self.batch_max_size > 1:
+            return await self._detect_batched(image_bytes, options)
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        self.pending_jobs += 1
+        try:
+            job = executor.submit(_detect_in_worker, image_bytes, options)
+        except BrokenProcessPool:
+            self._release_slot()
+            self._restart_executor(executor)
+            return False, 'processing_error', {}
+
+        # The slot is freed when the worker is really done, not when we stop waiting
+        job.add_done_callback(lambda _: self._schedule_release(loop))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Face detection timed out after {self.timeout}s")
+            return False, 'processing_error', {}
+        except BrokenProcessPool:
+            self._restart_executor(executor)
+            return False, 'processing_error', {}
+
+    async def _detect_batched(self, image_bytes, options: dict) -> tuple[bool, str, dict]:
+        """Queue the job for the next micro-batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((image_bytes, options, future, time.monotonic()))
+        self.pending_jobs += 1
+
+        if len(self._batch) >= self.batch_max_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_max_wait, self._flush_batch)
+
+        try:
+            # shield: a timed out waiter must not cancel the future the batch will resolve
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Face detection timed out after {self.timeout}s")
+            return False, 'processing_error', {}
+        except Exception as e:
+            logger.error(f"Batched face detection failed: {e}")
+            return False, 'processing_error', {}
+
+    def _flush_batch(self):
+        """Dispatch the collected jobs, split evenly over the workers"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        now = time.monotonic()
+        self.batch_metrics.record_batch([now - enqueued_at for _, _, _, enqueued_at in batch])
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        for chunk in (batch[i::self.workers] for i in range(min(self.workers, len(batch)))):
+            try:
+                job = executor.submit(_detect_batch_in_worker, [(image_bytes, options) for image_bytes, options, _, _ in chunk])
+            except Exception as e:
+                # Broken or already shut down pool, fail these jobs instead of leaving them hanging
+                self._finish_chunk(chunk, executor, None, e)
+                continue
+            job.add_done_callback(lambda job, chunk=chunk: self._schedule_finish(loop, chunk, executor, job))
+
+    def _schedule_finish(self, loop, chunk: list, executor, job):
+        try:
+            loop.call_soon_threadsafe(self._finish_chunk, chunk, executor, job, None)
+        except RuntimeError:
+            pass  # Event loop already closed during shutdown
+
+    def _finish_chunk(self, chunk: list, executor, job, error):
+        """Hand each job in a finished chunk its result"""
+        self.pending_jobs -= len(chunk)
+        if error is None:
+            error = job.exception() if not job.cancelled() else asyncio.CancelledError()
+        if isinstance(error, BrokenProcessPool):
+            self._restart_executor(executor)
+
+        results = job.result() if error is None else [None] * len(chunk)
+        for (_, _, future, _), result in zip(chunk, results):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _restart_executor(self, broken_executor):
+        # Concurrent jobs all see the same broken pool; only the first one replaces it
+        if self._executor is not broken_executor:
+            return
+        logger.error("Face detection worker died, restarting workers")
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self._start_executor()
+
+    def shutdown(self):
+        """Stop the workers and drop queued jobs"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        for _, _, future, _ in self._batch:
+            if not future.done():
+                future.cancel()
+        self._batch = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
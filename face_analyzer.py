@@ -1,132 +1,360 @@
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
 import io
+import math
 import base64
-from config import MAX_IMAGE_SIZE, SUPPORTED_FORMATS
+from config import (
+    MAX_IMAGE_SIZE,
+    SUPPORTED_FORMATS,
+    FACE_DETECTION_MAX_EDGE,
+    FACE_DETECTOR_BACKEND,
+    QUALITY_GATE_ENABLED,
+    QUALITY_THUMBNAIL_EDGE,
+    QUALITY_MIN_SHARPNESS,
+    QUALITY_MIN_BRIGHTNESS,
+    QUALITY_MAX_BRIGHTNESS,
+    QUALITY_MIN_FACE_AREA_RATIO,
+    VISION_PAYLOAD_MODE,
+    VISION_FACE_MARGIN,
+    VISION_MAX_EDGE,
+    VISION_JPEG_QUALITY
+)
+from face_detectors import create_face_detector
+from memory_accounting import MemoryTracker
+
+EXIF_ORIENTATION = 0x0112
+
+class BufferReader(io.RawIOBase):
+    """Read-only file object over a bytes-like buffer that doesn't copy it like BytesIO does"""
+    
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def readinto(self, target) -> int:
+        count = max(0, min(len(target), len(self._view) - self._position))
+        target[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+    
+    def tell(self) -> int:
+        return self._position
 
 class FaceAnalyzer:
-    def __init__(self):
-        # Initialize face cascade classifier
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    def __init__(self, detector_backend: str = FACE_DETECTOR_BACKEND):
+        # Face detection backend, eyes and smiles always use the Haar cascades
+        self.face_detector = create_face_detector(detector_backend)
         self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
         self.smile_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml')
     
-    def validate_image(self, image_bytes: bytes) -> tuple[bool, str]:
+    def validate_image(self, image_bytes) -> tuple[bool, str]:
         """Validate image format, size and quality"""
+        error, _ = self._probe_image(image_bytes)
+        if error:
+            return False, error
+        return True, 'valid'
+    
+    def _probe_image(self, image_bytes) -> tuple[str, Image.Image]:
+        """Check the image from its header only and return (error, PIL image)"""
         try:
             # Check file size
             if len(image_bytes) > MAX_IMAGE_SIZE:
-                return False, 'file_too_large'
+                return 'file_too_large', None
             
-            # Try to open and validate image
-            image = Image.open(io.BytesIO(image_bytes))
+            # PIL only parses the header here, pixels are decoded later by OpenCV
+            image = Image.open(BufferReader(image_bytes))
             
             # Check format
             if image.format not in SUPPORTED_FORMATS:
-                return False, 'unsupported_format'
+                return 'unsupported_format', None
             
             # Check minimum dimensions
             if image.width < 100 or image.height < 100:
-                return False, 'poor_quality'
+                return 'poor_quality', None
             
-            return True, 'valid'
+            return None, image
             
         except Exception:
-            return False, 'unsupported_format'
+            return 'unsupported_format', None
+    
+    def _jpeg_thumbnail(self, image: Image.Image):
+        """Decode a small grayscale thumbnail of a JPEG using DCT scaling"""
+        # draft() makes libjpeg decode at 1/2, 1/4 or 1/8 scale, far cheaper than a full decode
+        image.draft('L', (QUALITY_THUMBNAIL_EDGE, QUALITY_THUMBNAIL_EDGE))
+        image = image.convert('L')
+        image.thumbnail((QUALITY_THUMBNAIL_EDGE, QUALITY_THUMBNAIL_EDGE))
+        return np.asarray(image)
+    
+    def _jpeg_detection_copy(self, image_bytes, max_edge: int):
+        """Decode a grayscale JPEG copy capped at max_edge using DCT scaling, oriented like cv2.imdecode"""
+        image = Image.open(BufferReader(image_bytes))
+        image.draft('L', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image).convert('L')
+        image.thumbnail((max_edge, max_edge))
+        return np.asarray(image)
+    
+    def _min_face_size(self, width: int, height: int) -> int:
+        """Smallest face side worth finding; smaller faces would fail the area gate anyway"""
+        if not QUALITY_GATE_ENABLED:
+            return 50
+        return max(50, math.ceil(math.sqrt(QUALITY_MIN_FACE_AREA_RATIO * width * height)))
+    
+    def _face_gate(self, faces: list, width: int, height: int) -> str:
+        """Return the error for a face count or face size the analysis can't use"""
+        if len(faces) == 0:
+            return 'no_face'
+        if len(faces) > 1:
+            return 'multiple_faces'
+        # A tiny face gives meaningless features
+        _, _, face_w, face_h = faces[0]
+        if QUALITY_GATE_ENABLED and face_w * face_h < QUALITY_MIN_FACE_AREA_RATIO * width * height:
+            return 'poor_quality'
+        return None
     
-    def detect_faces(self, image_bytes: bytes) -> tuple[bool, str, dict]:
-        """Detect faces in the image and extract basic features"""
+    def _gray_thumbnail(self, gray):
+        """Downscale an already decoded grayscale image to thumbnail size"""
+        scale = QUALITY_THUMBNAIL_EDGE / max(gray.shape[:2])
+        if scale >= 1.0:
+            return gray
+        size = (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale)))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    
+    def _check_quality(self, thumbnail) -> str:
+        """Return 'poor_quality' for blurry, too dark or overexposed thumbnails"""
+        sharpness = cv2.Laplacian(thumbnail, cv2.CV_64F).var()
+        if sharpness < QUALITY_MIN_SHARPNESS:
+            return 'poor_quality'
+        
+        brightness = np.mean(thumbnail)
+        if brightness < QUALITY_MIN_BRIGHTNESS or brightness > QUALITY_MAX_BRIGHTNESS:
+            return 'poor_quality'
+        
+        return None
+    
+    def detect_faces(self, image_bytes, detect_eyes: bool = True, include_image: bool = True) -> tuple[bool, str, dict]:
+        """Detect faces in the image and extract basic features
+        
+        image_bytes can be bytes, a bytearray or a memoryview and is never copied.
+        detect_eyes=False skips the eye cascade for analyses that don't use eye features.
+        include_image=False skips building the base64 image payload for the vision model.
+        """
+        # Counts what detection allocates on top of the input buffer
+        memory = MemoryTracker()
         try:
             # Validate image first
-            is_valid, error = self.validate_image(image_bytes)
-            if not is_valid:
+            error, image = self._probe_image(image_bytes)
+            if error:
                 return False, error, {}
             
-            # Convert bytes to OpenCV image
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            # Large JPEGs with a grayscale detector are searched on a DCT-scaled decode,
+            # so photos without one usable face are rejected before the full decode
+            is_jpeg = image.format == 'JPEG'
+            width, height = image.size
+            detection_copy = None
+            faces = None
+            if (is_jpeg and not self.face_detector.uses_color and FACE_DETECTION_MAX_EDGE
+                    and max(width, height) > FACE_DETECTION_MAX_EDGE):
+                detection_copy = self._jpeg_detection_copy(image_bytes, FACE_DETECTION_MAX_EDGE)
+                memory.hold('detection_copy', detection_copy.nbytes)
+                # EXIF orientations 5-8 rotate by 90 degrees, as the full decode will
+                if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                    width, height = height, width
             
-            if img is None:
-                return False, 'processing_error', {}
+            # JPEGs get a cheap quality check before the full decode
+            if QUALITY_GATE_ENABLED and is_jpeg:
+                if detection_copy is not None:
+                    thumbnail = self._gray_thumbnail(detection_copy)
+                else:
+                    thumbnail = self._jpeg_thumbnail(image)
+                error = self._check_quality(thumbnail)
+                if error:
+                    return False, error, {}
             
-            # Convert to grayscale for face detection
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            if detection_copy is not None:
+                # None when faces may be too small for the copy and need the full-resolution pass
+                faces = self._detect_on_copy(detection_copy, width, height, self._min_face_size(width, height))
+                if faces is not None:
+                    error = self._face_gate(faces, width, height)
+                    if error:
+                        return False, error, {}
             
-            # Detect faces
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(50, 50)
-            )
+            # Full-image JPEG payloads are the original bytes, a face crop needs colour pixels
+            crop_payload = include_image and VISION_PAYLOAD_MODE == 'face_crop'
+            reuse_original = include_image and not crop_payload and is_jpeg
+            need_color = self.face_detector.uses_color or crop_payload or (include_image and not is_jpeg)
             
-            if len(faces) == 0:
-                return False, 'no_face', {}
+            # Decode the pixels exactly once. When no colour is needed,
+            # libjpeg can decode straight to grayscale.
+            nparr = np.frombuffer(image_bytes, np.uint8)
+            if not need_color:
+                gray = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+                img = None
+            else:
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img is not None else None
+            
+            if gray is None:
+                return False, 'processing_error', {}
+            memory.hold('gray', gray.nbytes)
+            if img is not None:
+                memory.hold('img', img.nbytes)
             
-            if len(faces) > 1:
-                return False, 'multiple_faces', {}
+            # Other formats have no cheap reduced decode, so check them on the decoded pixels
+            if QUALITY_GATE_ENABLED and not is_jpeg:
+                error = self._check_quality(self._gray_thumbnail(gray))
+                if error:
+                    return False, error, {}
+            
+            # Detect faces, unless the reduced copy already settled it
+            if faces is None:
+                faces = self._find_faces(img if self.face_detector.uses_color else gray,
+                                         self._min_face_size(gray.shape[1], gray.shape[0]))
+                # Stop before feature extraction and payload encoding
+                error = self._face_gate(faces, gray.shape[1], gray.shape[0])
+                if error:
+                    return False, error, {}
             
             # Extract features from the detected face
-            face_features = self._extract_face_features(img, gray, faces[0])
+            face_features = self._extract_face_features(gray, faces[0], detect_eyes)
             
-            # Convert main image to base64 for OpenAI analysis
-            _, buffer = cv2.imencode('.jpg', img)
-            base64_image = base64.b64encode(buffer).decode('utf-8')
+            # Convert the image to base64 for OpenAI analysis
+            base64_image = None
+            if crop_payload:
+                buffer = self.build_face_payload(img, faces[0])
+                memory.hold('jpeg', buffer.nbytes)
+                base64_image = base64.b64encode(buffer).decode('utf-8')
+            elif reuse_original:
+                base64_image = base64.b64encode(image_bytes).decode('utf-8')
+            elif include_image:
+                _, buffer = cv2.imencode('.jpg', img)
+                memory.hold('jpeg', buffer.nbytes)
+                base64_image = base64.b64encode(buffer).decode('utf-8')
+            if base64_image:
+                memory.hold('base64', len(base64_image))
             
             return True, 'success', {
                 'face_features': face_features,
                 'base64_image': base64_image,
-                'image_dimensions': (img.shape[1], img.shape[0])
+                'image_dimensions': (gray.shape[1], gray.shape[0]),
+                'memory_peak_bytes': memory.peak
             }
             
         except Exception as e:
             print(f"Face detection error: {e}")
             return False, 'processing_error', {}
+        finally:
+            for name in list(memory.buffers):
+                memory.release(name)
+    
+    def build_face_payload(self, img, face_rect):
+        """Crop to the face plus a margin, cap the size and re-encode as JPEG"""
+        x, y, w, h = face_rect
+        height, width = img.shape[:2]
+        margin_x = int(w * VISION_FACE_MARGIN)
+        margin_y = int(h * VISION_FACE_MARGIN)
+        crop = img[max(0, y - margin_y):min(height, y + h + margin_y),
+                   max(0, x - margin_x):min(width, x + w + margin_x)]
+        
+        scale = VISION_MAX_EDGE / max(crop.shape[:2])
+        if scale < 1.0:
+            size = (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale)))
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        
+        _, buffer = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, VISION_JPEG_QUALITY])
+        return buffer
     
-    def _extract_face_features(self, img, gray, face_rect) -> dict:
+    def _find_faces(self, image, min_face_size: int = 50) -> list:
+        """Run the face detector on a bounded-size copy and map faces back to full resolution"""
+        height, width = image.shape[:2]
+        longest_edge = max(height, width)
+        
+        if not FACE_DETECTION_MAX_EDGE or longest_edge <= FACE_DETECTION_MAX_EDGE:
+            return self.face_detector.detect(image, min_face_size)
+        
+        scale = FACE_DETECTION_MAX_EDGE / longest_edge
+        small = cv2.resize(
+            image,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+        
+        faces = self._detect_on_copy(small, width, height, min_face_size)
+        if faces is None:
+            return self.face_detector.detect(image, min_face_size)
+        return faces
+    
+    def _detect_on_copy(self, small, width: int, height: int, min_face_size: int = 50):
+        """Run the face detector on a downscaled copy, faces are mapped back to width x height
+        
+        Returns None when nothing was found but faces below the detector window could
+        have vanished in the copy, so the caller has to search the full resolution image.
+        """
+        scale = small.shape[1] / width
+        
+        # Faces smaller than the detector window can vanish in the small copy
+        min_window = self.face_detector.min_window
+        scaled_min_size = int(min_face_size * scale)
+        faces = self.face_detector.detect(small, max(min_window, scaled_min_size))
+        if len(faces) == 0 and scaled_min_size < min_window:
+            return None
+        
+        full_faces = []
+        for (x, y, w, h) in faces:
+            x, y = int(x / scale), int(y / scale)
+            w = min(int(round(w / scale)), width - x)
+            h = min(int(round(h / scale)), height - y)
+            full_faces.append((x, y, w, h))
+        return full_faces
+    
+    def _extract_face_features(self, gray, face_rect, detect_eyes: bool = True) -> dict:
         """Extract detailed facial features from detected face"""
         x, y, w, h = face_rect
         
         # Extract face region
         face_gray = gray[y:y+h, x:x+w]
-        face_color = img[y:y+h, x:x+w]
         
         features = {
             'face_dimensions': (w, h),
             'face_position': (x, y),
-            'face_area_ratio': (w * h) / (img.shape[0] * img.shape[1])
+            'face_area_ratio': (w * h) / (gray.shape[0] * gray.shape[1])
         }
         
-        # Detect eyes within face region
-        eyes = self.eye_cascade.detectMultiScale(face_gray, 1.1, 5)
-        features['eye_count'] = len(eyes)
-        
-        if len(eyes) >= 2:
-            # Calculate eye distance and symmetry
-            eye_centers = []
-            for (ex, ey, ew, eh) in eyes[:2]:
-                center_x = ex + ew // 2
-                center_y = ey + eh // 2
-                eye_centers.append((center_x, center_y))
-            
-            if len(eye_centers) == 2:
-                eye_distance = np.sqrt((eye_centers[0][0] - eye_centers[1][0])**2 + 
-                                     (eye_centers[0][1] - eye_centers[1][1])**2)
-                features['eye_distance'] = eye_distance
-                features['eye_symmetry'] = abs(eye_centers[0][1] - eye_centers[1][1])
+        if detect_eyes:
+            features.update(self._detect_eye_features(face_gray))
         
-        # Detect smile
-        smiles = self.smile_cascade.detectMultiScale(face_gray, 1.8, 20)
+        # Detect smile in the lower part of the face only, with sizes bounded by the face box
+        mouth_top = int(h * 0.55)
+        smiles = self.smile_cascade.detectMultiScale(
+            face_gray[mouth_top:, :],
+            scaleFactor=1.8,
+            minNeighbors=20,
+            minSize=(max(1, w // 5), max(1, h // 12)),
+            maxSize=(max(1, int(w * 0.75)), max(1, h // 3))
+        )
         features['smile_detected'] = len(smiles) > 0
         features['smile_intensity'] = len(smiles)
         
         # Calculate face proportions
         features['face_width_height_ratio'] = w / h if h > 0 else 0
         
-        # Analyze brightness and contrast
-        face_brightness = np.mean(face_gray)
-        face_contrast = np.std(face_gray)
+        # Analyze brightness and contrast (plain floats keep features JSON-serializable)
+        face_brightness = float(np.mean(face_gray))
+        face_contrast = float(np.std(face_gray))
         features['brightness'] = face_brightness
         features['contrast'] = face_contrast
         
@@ -134,3 +362,34 @@ class FaceAnalyzer:
         features['face_center'] = (x + w//2, y + h//2)
         
         return features
+    
+    def _detect_eye_features(self, face_gray) -> dict:
+        """Detect eyes in the upper part of the face and measure their geometry"""
+        h, w = face_gray.shape[:2]
+        
+        # Eyes sit between roughly 15% and 55% of the face height
+        eye_top = int(h * 0.15)
+        eye_bottom = int(h * 0.55)
+        eyes = self.eye_cascade.detectMultiScale(
+            face_gray[eye_top:eye_bottom, :],
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(max(1, w // 10), max(1, w // 10)),
+            maxSize=(max(1, w // 3), max(1, w // 3))
+        )
+        features = {'eye_count': len(eyes)}
+        
+        if len(eyes) >= 2:
+            # Calculate eye distance and symmetry in face coordinates
+            eye_centers = []
+            for (ex, ey, ew, eh) in eyes[:2]:
+                center_x = int(ex + ew // 2)
+                center_y = int(eye_top + ey + eh // 2)
+                eye_centers.append((center_x, center_y))
+            
+            eye_distance = float(np.sqrt((eye_centers[0][0] - eye_centers[1][0])**2 + 
+                                       (eye_centers[0][1] - eye_centers[1][1])**2))
+            features['eye_distance'] = eye_distance
+            features['eye_symmetry'] = abs(eye_centers[0][1] - eye_centers[1][1])
+        
+        return features
@@ -0,0 +1,104 @@
+import os
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+from config import DNN_FACE_PROTOTXT, DNN_FACE_MODEL, DNN_FACE_CONFIDENCE
+
+class FaceDetector(ABC):
+    """Face detection backend used by FaceAnalyzer"""
+
+    name = 'base'
+    # Backends that need BGR input get the colour image, the others get grayscale
+    uses_color = False
+    # Smallest face (in pixels) the backend can find, used to decide on full-resolution re-checks
+    min_window = 0
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """Whether everything the backend needs (model files etc.) is present"""
+        return True
+
+    @abstractmethod
+    def detect(self, image, min_face_size: int) -> list:
+        """Return face rectangles as (x, y, w, h) tuples of ints"""
+
+class HaarCascadeDetector(FaceDetector):
+    """The frontal face Haar cascade shipped with OpenCV"""
+
+    name = 'haar'
+    min_window = 24
+
+    def __init__(self):
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def detect(self, image, min_face_size: int) -> list:
+        faces = self.face_cascade.detectMultiScale(
+            image,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(min_face_size, min_face_size)
+        )
+        return [tuple(int(v) for v in face) for face in faces]
+
+class DnnFaceDetector(FaceDetector):
+    """OpenCV DNN face detector (ResNet-10 SSD, 300x300 input) running on the CPU"""
+
+    name = 'dnn'
+    uses_color = True
+    input_size = (300, 300)
+    mean_values = (104.0, 177.0, 123.0)
+
+    def __init__(self, prototxt: str = DNN_FACE_PROTOTXT, model: str = DNN_FACE_MODEL,
+                 confidence: float = DNN_FACE_CONFIDENCE):
+        for path in (prototxt, model):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"DNN face model file not found: {path} (run fetch_face_models.py)")
+
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence = confidence
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return os.path.exists(DNN_FACE_PROTOTXT) and os.path.exists(DNN_FACE_MODEL)
+
+    def detect(self, image, min_face_size: int) -> list:
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(
+            cv2.resize(image, self.input_size, interpolation=cv2.INTER_AREA),
+            1.0,
+            self.input_size,
+            self.mean_values
+        )
+        self.net.setInput(blob)
+        detections = self.net.forward()
+
+        faces = []
+        for detection in detections[0, 0]:
+            if detection[2] < self.confidence:
+                continue
+
+            # Box corners come back normalized to [0, 1]
+            x1, y1, x2, y2 = (detection[3:7] * np.array([width, height, width, height])).astype(int)
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            w, h = x2 - x1, y2 - y1
+            if w >= min_face_size and h >= min_face_size:
+                faces.append((int(x1), int(y1), int(w), int(h)))
+        return faces
+
+FACE_DETECTORS = {
+    HaarCascadeDetector.name: HaarCascadeDetector,
+    DnnFaceDetector.name: DnnFaceDetector
+}
+
+def create_face_detector(name: str) -> FaceDetector:
+    """Build the face detection backend with the given name"""
+    if name not in FACE_DETECTORS:
+        raise ValueError(f"Unknown face detector backend: {name}")
+    return FACE_DETECTORS[name]()
+
+def available_face_detectors() -> list:
+    """Names of the backends that can be built in this installation"""
+    return [name for name, detector in FACE_DETECTORS.items() if detector.is_available()]
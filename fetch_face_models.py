@@ -0,0 +1,63 @@
+"""Download the model files for the cv2.dnn face detector backend
+
+Usage:
+    python fetch_face_models.py
+
+Fetches the ResNet-10 SSD face detector from OpenCV's release assets into
+DNN_FACE_MODEL_DIR. The weights are checked against the SHA-1 that OpenCV
+publishes for them; the network definition is checked by loading both files
+with cv2.dnn. Files that are already present and valid are left alone.
+"""
+import hashlib
+import os
+import sys
+
+import cv2
+import requests
+
+from config import DNN_FACE_MODEL_DIR, DNN_FACE_PROTOTXT, DNN_FACE_MODEL
+
+PROTOTXT_URL = "https://raw.githubusercontent.com/opencv/opencv/4.10.0/samples/dnn/face_detector/deploy.prototxt"
+MODEL_URL = ("https://raw.githubusercontent.com/opencv/opencv_3rdparty/"
+             "dnn_samples_face_detector_20180205_fp16/res10_300x300_ssd_iter_140000_fp16.caffemodel")
+# From opencv/samples/dnn/face_detector/download_weights.py
+MODEL_SHA1 = "31fc22bfdd907567a04bb45b7cfad29966caddc1"
+
+def _sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _download(url: str, path: str):
+    """Download to a temporary file and move it into place once complete"""
+    print(f"downloading {url}")
+    response = requests.get(url, stream=True, timeout=30)
+    response.raise_for_status()
+    partial = path + '.part'
+    with open(partial, 'wb') as f:
+        for block in response.iter_content(1 << 20):
+            f.write(block)
+    os.replace(partial, path)
+
+def main():
+    os.makedirs(DNN_FACE_MODEL_DIR, exist_ok=True)
+
+    if not os.path.exists(DNN_FACE_MODEL) or _sha1(DNN_FACE_MODEL) != MODEL_SHA1:
+        _download(MODEL_URL, DNN_FACE_MODEL)
+        if _sha1(DNN_FACE_MODEL) != MODEL_SHA1:
+            os.remove(DNN_FACE_MODEL)
+            sys.exit(f"checksum mismatch for {MODEL_URL}, file removed")
+
+    if not os.path.exists(DNN_FACE_PROTOTXT):
+        _download(PROTOTXT_URL, DNN_FACE_PROTOTXT)
+
+    try:
+        cv2.dnn.readNetFromCaffe(DNN_FACE_PROTOTXT, DNN_FACE_MODEL)
+    except cv2.error as e:
+        sys.exit(f"model files in {DNN_FACE_MODEL_DIR} do not load: {e}")
+    print(f"face detector model ready in {DNN_FACE_MODEL_DIR}")
+
+if __name__ == "__main__":
+    main()
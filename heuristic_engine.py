@@ -0,0 +1,137 @@
+import numpy as np
+
+# Noise added to each trait, mirrors PersonalityAnalyzer._get_simple_analysis: (base, low, high)
+TRAIT_NOISE = {
+    'extraversion': ('happiness', -0.1, 0.2),
+    'openness': ('energy', -0.1, 0.2),
+    'conscientiousness': ('confidence', -0.1, 0.2),
+    'agreeableness': ('happiness', -0.1, 0.1),
+    'creativity': ('energy', -0.2, 0.3),
+    'leadership': ('confidence', -0.1, 0.2)
+}
+TRAIT_ORDER = ('extraversion', 'openness', 'conscientiousness', 'agreeableness',
+               'confidence', 'creativity', 'leadership')
+
+# Mirrors PersonalityAnalyzer._get_vip_features: base + randint(low, high), capped at 100
+ADVANCED_TRAIT_RANGES = {
+    'intelligence_quotient': (70, 10, 25),
+    'emotional_intelligence': (60, 15, 30),
+    'charisma_level': (50, 20, 40),
+    'business_acumen': (40, 20, 45),
+    'artistic_talent': (45, 15, 40),
+    'leadership_potential': (55, 20, 35)
+}
+LIFE_PATTERN_CHOICES = {
+    'risk_tolerance': ('محافظه‌کار', 'متعادل', 'مخاطره‌پذیر'),
+    'decision_style': ('تحلیلی', 'شهودی', 'ترکیبی'),
+    'social_preference': ('درون‌گرا', 'برون‌گرا', 'دوسویه'),
+    'work_style': ('مستقل', 'تیمی', 'رهبری')
+}
+
+# One random column per noisy trait, calmness, advanced trait and life pattern
+_RANDOM_COLUMNS = len(TRAIT_NOISE) + 1 + len(ADVANCED_TRAIT_RANGES) + len(LIFE_PATTERN_CHOICES)
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer, a fast counter-based hash over uint64 arrays"""
+    with np.errstate(over='ignore'):
+        z = values + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def seeded_uniforms(seeds: np.ndarray, columns: int) -> np.ndarray:
+    """Uniform [0, 1) numbers, one row per seed; a row depends only on its own seed"""
+    counters = seeds.astype(np.uint64)[:, None] * np.uint64(columns) + np.arange(columns, dtype=np.uint64)
+    bits = _splitmix64(_splitmix64(counters))
+    return (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+class HeuristicEngine:
+    """Batch version of the feature-based analysis in PersonalityAnalyzer
+
+    Scores a whole batch of face_features with NumPy and returns results in the same
+    dict schema as _get_simple_analysis (plus the VIP sections when vip=True).
+    Assessment texts come from the given analyzer so the wording stays in one place.
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        # _generate_persian_assessment only depends on three buckets, render each combination once
+        self.assessments = {
+            (smile, brightness_bucket, balanced): analyzer._generate_persian_assessment(
+                smile, (50, 100, 130)[brightness_bucket], 1.0 if balanced else 1.5
+            )
+            for smile in (False, True)
+            for brightness_bucket in range(3)
+            for balanced in (False, True)
+        }
+
+    def score_batch(self, face_features_list: list, seeds=None) -> dict:
+        """Return trait arrays (one entry per input) for the whole batch"""
+        count = len(face_features_list)
+        if seeds is None:
+            seeds = np.random.default_rng().integers(0, 2**63, size=count, dtype=np.uint64)
+        uniforms = seeded_uniforms(np.asarray(seeds, dtype=np.uint64), _RANDOM_COLUMNS)
+
+        brightness = np.fromiter((f.get('brightness', 100) for f in face_features_list), np.float64, count)
+        smile = np.fromiter((bool(f.get('smile_detected', False)) for f in face_features_list), bool, count)
+        face_ratio = np.fromiter((f.get('face_width_height_ratio', 1.0) for f in face_features_list), np.float64, count)
+
+        bases = {
+            'happiness': np.where(smile, 0.8, 0.4),
+            'energy': np.minimum(1.0, brightness / 150),
+            'confidence': np.where((face_ratio >= 0.7) & (face_ratio <= 1.3), 0.7, 0.5)
+        }
+
+        arrays = {'smile': smile, 'brightness': brightness, 'face_ratio': face_ratio}
+        column = 0
+        for trait, (base, low, high) in TRAIT_NOISE.items():
+            arrays[trait] = np.minimum(1.0, bases[base] + low + uniforms[:, column] * (high - low))
+            column += 1
+        arrays['confidence'] = bases['confidence']
+
+        arrays['happiness'] = bases['happiness']
+        arrays['calmness'] = np.minimum(1.0, 0.6 - 0.1 + uniforms[:, column] * 0.3)
+        column += 1
+        arrays['energy_level'] = bases['energy']
+        arrays['stress_level'] = np.maximum(0.0, 0.3 - bases['happiness'] * 0.2)
+
+        for trait, (base, low, high) in ADVANCED_TRAIT_RANGES.items():
+            arrays[trait] = np.minimum(100, base + low + (uniforms[:, column] * (high - low + 1)).astype(np.int64))
+            column += 1
+        for pattern, choices in LIFE_PATTERN_CHOICES.items():
+            arrays[pattern] = (uniforms[:, column] * len(choices)).astype(np.int64)
+            column += 1
+
+        return arrays
+
+    def analyze_batch(self, face_features_list: list, seeds=None, vip: bool = False) -> list:
+        """Score a batch and return one result dict per input, in the analyzer's schema"""
+        arrays = self.score_batch(face_features_list, seeds)
+        columns = {name: values.tolist() for name, values in arrays.items()}
+
+        brightness_buckets = np.select([arrays['brightness'] > 120, arrays['brightness'] < 80], [2, 0], 1).tolist()
+        balanced = ((arrays['face_ratio'] >= 0.8) & (arrays['face_ratio'] <= 1.2)).tolist()
+
+        results = []
+        for i, face_features in enumerate(face_features_list):
+            result = {
+                'personality_traits': {trait: columns[trait][i] for trait in TRAIT_ORDER},
+                'emotional_state': {
+                    'happiness': columns['happiness'][i],
+                    'calmness': columns['calmness'][i],
+                    'energy_level': columns['energy_level'][i],
+                    'stress_level': columns['stress_level'][i]
+                },
+                'overall_assessment': self.assessments[(columns['smile'][i], brightness_buckets[i], balanced[i])]
+            }
+            if vip:
+                result['advanced_traits'] = {trait: columns[trait][i] for trait in ADVANCED_TRAIT_RANGES}
+                result['life_patterns'] = {
+                    pattern: choices[columns[pattern][i]] for pattern, choices in LIFE_PATTERN_CHOICES.items()
+                }
+                result['vip_assessment'] = self.analyzer._generate_vip_assessment(face_features)
+                result['career_guidance'] = self.analyzer._get_career_guidance(result)
+                result['relationship_insights'] = self.analyzer._get_relationship_insights(result)
+                result['success_factors'] = self.analyzer._get_success_factors(result)
+            results.append(result)
+        return results
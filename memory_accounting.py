@@ -0,0 +1,62 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bytes held by all requests in this process right now, and the highest value seen.
+# Detection threads update these too, hence the lock.
+in_flight_bytes = 0
+in_flight_peak = 0
+_in_flight_lock = threading.Lock()
+
+def _log_request_memory(label: str, peak_bytes: int, in_flight_peak_bytes: int):
+    logger.debug(f"Memory for {label}: peak {peak_bytes / 1024:.0f} KiB, "
+                f"process in-flight peak {in_flight_peak_bytes / 1024:.0f} KiB")
+
+_memory_hook = _log_request_memory
+
+def set_memory_hook(hook):
+    """Replace the callback that receives (label, peak_bytes, in_flight_peak_bytes) per request"""
+    global _memory_hook
+    _memory_hook = hook
+
+class MemoryTracker:
+    """Accounts for the large buffers a single request holds"""
+
+    def __init__(self, label: str = "request"):
+        self.label = label
+        self.buffers = {}
+        self.current = 0
+        self.peak = 0
+
+    def hold(self, name: str, nbytes: int):
+        """Record that the request now holds a buffer of nbytes"""
+        global in_flight_bytes, in_flight_peak
+        self.release(name)
+        self.buffers[name] = nbytes
+        self.current += nbytes
+        self.peak = max(self.peak, self.current)
+        with _in_flight_lock:
+            in_flight_bytes += nbytes
+            in_flight_peak = max(in_flight_peak, in_flight_bytes)
+
+    def release(self, name: str):
+        """Record that a buffer is no longer referenced"""
+        global in_flight_bytes
+        nbytes = self.buffers.pop(name, 0)
+        self.current -= nbytes
+        with _in_flight_lock:
+            in_flight_bytes -= nbytes
+
+    def add_peak(self, nbytes: int):
+        """Account for a short-lived peak measured elsewhere, e.g. inside a detection worker"""
+        self.peak = max(self.peak, self.current + nbytes)
+
+    def report(self):
+        """Release everything and pass the request's peak to the memory hook"""
+        for name in list(self.buffers):
+            self.release(name)
+        try:
+            _memory_hook(self.label, self.peak, in_flight_peak)
+        except Exception as e:
+            logger.error(f"Memory hook failed: {e}")
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import time
+from config import TELEGRAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class ThrottledEditor:
+    """Edits one Telegram message with progressive content, staying under the edit rate limit"""
+
+    def __init__(self, message, min_interval: float = TELEGRAM_EDIT_INTERVAL):
+        self.message = message
+        self.min_interval = min_interval
+        self.last_text = None
+        self.last_edit = 0.0
+        self.pending_text = None
+        self._task = None
+
+    def submit(self, text: str):
+        """Show intermediate content without waiting for Telegram
+
+        Edits run in a background task; text submitted while an edit is in
+        progress or throttled replaces the pending text, so only the latest is shown.
+        """
+        self.pending_text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def finish(self, text: str):
+        """Show the final content, errors propagate to the caller"""
+        self.cancel()
+        await self._edit(text)
+
+    def cancel(self):
+        """Drop intermediate content that hasn't been shown yet"""
+        self.pending_text = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _drain(self):
+        while self.pending_text is not None:
+            delay = self.min_interval - (time.monotonic() - self.last_edit)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text, self.pending_text = self.pending_text, None
+            try:
+                await self._edit(text)
+            except Exception as e:
+                # A lost intermediate edit is harmless, the final one carries everything
+                logger.warning(f"Progressive edit failed: {e}")
+
+    async def _edit(self, text: str):
+        # Telegram rejects edits that don't change the text
+        if text == self.last_text:
+            return
+        await self.message.edit_text(text, parse_mode='Markdown')
+        self.last_text = text
+        self.last_edit = time.monotonic()
@@ -1,8 +1,11 @@
 import os
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text
+from typing import NamedTuple, Optional
+from sqlalchemy import create_engine, select, Column, Integer, String, DateTime, Boolean, Text, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from user_state_cache import user_state_cache
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 engine = create_engine(DATABASE_URL)
@@ -39,6 +42,23 @@ class AnalysisHistory(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_telegram_id = Column(Integer, index=True)
     analysis_type = Column(String)  # free, vip
+    analysis_data = Column(Text)  # analysis_codec encoding, or JSON for older rows
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AssessmentText(Base):
+    __tablename__ = "assessment_texts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    digest = Column(String(40), unique=True, index=True)  # sha1 متن
+    text = Column(Text)  # متن ارزیابی که بین تحلیل‌ها تکرار می‌شود
+
+class PhotoAnalysisCache(Base):
+    __tablename__ = "photo_analysis_cache"
+    __table_args__ = (UniqueConstraint("file_unique_id", "analysis_type"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    file_unique_id = Column(String, index=True)  # شناسه یکتای فایل تلگرام
+    analysis_type = Column(String)  # free, vip
     analysis_data = Column(Text)  # JSON string
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -66,6 +86,64 @@ def get_user(telegram_id: int):
     finally:
         db.close()
 
+class UserState(NamedTuple):
+    """وضعیت اشتراک و استفاده رایگان کاربر در یک لحظه"""
+    telegram_id: int
+    is_vip: bool
+    vip_expires: Optional[datetime]
+    free_analysis_used: bool
+
+    @property
+    def can_analyze(self) -> bool:
+        return self.is_vip or not self.free_analysis_used
+
+# Dialects whose INSERT supports ON CONFLICT ... RETURNING
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+def user_state_from_row(telegram_id: int, is_vip: bool, vip_expires, free_analysis_used: bool,
+                        now: datetime) -> UserState:
+    return UserState(
+        telegram_id=telegram_id,
+        is_vip=bool(is_vip and vip_expires and vip_expires > now),
+        vip_expires=vip_expires,
+        free_analysis_used=bool(free_analysis_used)
+    )
+
+def user_state_select(telegram_id: int):
+    """خواندن وضعیت کاربر موجود، بدون نوشتن"""
+    return select(User.is_vip, User.vip_expires, User.free_analysis_used).where(User.telegram_id == telegram_id)
+
+def user_state_needs_write(row, now: datetime) -> bool:
+    """کاربر هنوز ساخته نشده یا پرچم VIP منقضی‌شده باید پاک شود"""
+    return row is None or bool(row.is_vip and row.vip_expires and row.vip_expires <= now)
+
+def user_state_upsert(dialect_name: str, telegram_id: int, now: datetime):
+    """دستور get-or-create کاربر با RETURNING، یا None اگر پایگاه‌داده پشتیبانی نکند
+
+    Only run after user_state_select found nothing to read as is. The conflict branch
+    only writes when it clears an expired VIP flag, like is_user_vip does; when it
+    writes nothing, no row is returned and the caller reads the row again.
+    """
+    upsert = UPSERT_INSERTS.get(dialect_name)
+    if upsert is None:
+        return None
+    return upsert(User).values(telegram_id=telegram_id).on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={'is_vip': False},
+        where=User.is_vip & (User.vip_expires <= now)
+    ).returning(User.is_vip, User.vip_expires, User.free_analysis_used)
+
+def get_user_state_fallback(db, telegram_id: int, now: datetime) -> UserState:
+    """نسخه بدون upsert برای پایگاه‌داده‌های دیگر، در همان session"""
+    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    if not user:
+        user = User(telegram_id=telegram_id)
+        db.add(user)
+    elif user.is_vip and user.vip_expires and user.vip_expires <= now:
+        user.is_vip = False
+    db.commit()
+    return user_state_from_row(telegram_id, user.is_vip, user.vip_expires, user.free_analysis_used, now)
+
 def is_user_vip(telegram_id: int) -> bool:
     """بررسی VIP بودن کاربر"""
     db = SessionLocal()
@@ -106,6 +184,7 @@ def mark_free_analysis_used(telegram_id: int):
             db.commit()
     finally:
         db.close()
+        user_state_cache.invalidate(telegram_id)
 
 def upgrade_to_vip(telegram_id: int):
     """ارتقاء کاربر به VIP"""
@@ -118,6 +197,7 @@ def upgrade_to_vip(telegram_id: int):
             db.commit()
     finally:
         db.close()
+        user_state_cache.invalidate(telegram_id)
 
 def save_analysis(telegram_id: int, analysis_type: str, analysis_data: str):
     """ذخیره تاریخچه تحلیل"""
@@ -131,4 +211,4 @@ def save_analysis(telegram_id: int, analysis_type: str, analysis_data: str):
         db.add(analysis)
         db.commit()
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
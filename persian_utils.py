@@ -1,143 +1,178 @@
+from types import MappingProxyType
+from config import TELEGRAM_MESSAGE_LIMIT
+
+TRAIT_LABELS = MappingProxyType({
+    'extraversion': '🎉 برون‌گرایی',
+    'openness': '🌈 انعطاف‌پذیری',
+    'conscientiousness': '📋 وظیفه‌شناسی',
+    'agreeableness': '🤝 توافق‌پذیری',
+    'neuroticism': '😟 نوروز‌گرایی',
+    'confidence': '💪 اعتماد به نفس',
+    'creativity': '🎨 خلاقیت',
+    'leadership': '👑 رهبری',
+    'empathy': '❤️ همدلی'
+})
+
+EMOTION_LABELS = MappingProxyType({
+    'happiness': 'شادی',
+    'sadness': 'غم',
+    'anger': 'خشم',
+    'fear': 'ترس',
+    'surprise': 'تعجب',
+    'disgust': 'انزجار',
+    'neutral': 'خنثی',
+    'stress_level': 'سطح استرس',
+    'energy_level': 'سطح انرژی'
+})
+
+VIP_TRAIT_LABELS = MappingProxyType({
+    'intelligence_quotient': '🧠 ضریب هوشی',
+    'emotional_intelligence': '💝 هوش عاطفی',
+    'charisma_level': '✨ جذابیت شخصی',
+    'business_acumen': '💼 هوش تجاری',
+    'artistic_talent': '🎨 استعداد هنری',
+    'leadership_potential': '👑 پتانسیل رهبری'
+})
+
+LIFE_PATTERN_LABELS = MappingProxyType({
+    'risk_tolerance': '⚡ تحمل ریسک',
+    'decision_style': '🎯 سبک تصمیم‌گیری',
+    'social_preference': '👥 ترجیح اجتماعی',
+    'work_style': '💪 سبک کاری'
+})
+
+# Characters that start an entity in Telegram's Markdown parse mode
+_MARKDOWN_ESCAPES = str.maketrans({char: '\\' + char for char in '_*`['})
+
+REPORT_TITLE = "✨ **نتیجه تحلیل جادویی شخصیت شما!** 🎭\n\n"
+PERSONALITY_HEADER = "🧠 **ویژگی‌های شخصیتی شما:**\n"
+EMOTION_HEADER = "😊 **وضعیت عاطفی:**\n"
+ASSESSMENT_HEADER = "📝 **ارزیابی کلی:**\n"
+ADVANCED_TRAITS_HEADER = "🎯 **ویژگی‌های پیشرفته (VIP):**\n"
+LIFE_PATTERNS_HEADER = "🔮 **الگوهای زندگی (VIP):**\n"
+CAREER_HEADER = "💼 **راهنمایی شغلی (VIP):**\n"
+RELATIONSHIP_HEADER = "💕 **بینش روابط (VIP):**\n"
+SUCCESS_HEADER = "🎯 **عوامل موفقیت (VIP):**\n"
+VIP_FOOTER = "👑 **تبریک! شما عضو VIP هستید و از تحلیل‌های تخصصی بهره می‌برید.**\n\n"
+DISCLAIMER = "⚠️ **توجه:** این تحلیل بر اساس ویژگی‌های ظاهری چهره انجام شده و صرفاً جنبه تفریحی دارد. برای ارزیابی دقیق شخصیت به متخصصان مراجعه کنید."
+
+def _score_lines(labels, suffix: str):
+    """Every report line of each known key, indexed by its whole percentage 0-100"""
+    return MappingProxyType({
+        key: tuple(f"• {label}: {percent}{suffix}" for percent in range(101))
+        for key, label in labels.items()
+    })
+
+# Scores are whole percentages, so each line is looked up instead of formatted
+TRAIT_LINES = _score_lines(TRAIT_LABELS, "%\n")
+EMOTION_LINES = _score_lines(EMOTION_LABELS, "%\n")
+VIP_TRAIT_LINES = _score_lines(VIP_TRAIT_LABELS, "% \n")
+LIFE_PATTERN_PREFIXES = MappingProxyType({key: f"• {label}: " for key, label in LIFE_PATTERN_LABELS.items()})
+
+def escape_markdown(text) -> str:
+    """Escape model-generated text so it can't break the report's Markdown"""
+    text = str(text)
+    # Substring checks are much cheaper than a regex on the usual text without any
+    if '_' in text or '*' in text or '`' in text or '[' in text:
+        return text.translate(_MARKDOWN_ESCAPES)
+    return text
+
+def _append_percentages(parts: list, values: dict, labels, lines):
+    for key, value in values.items():
+        if isinstance(value, (int, float)):
+            percent = int(value * 100) if value <= 1 else int(value)
+            key_lines = lines.get(key)
+            if key_lines is not None and 0 <= percent <= 100:
+                parts.append(key_lines[percent])
+            else:
+                parts.append(f"• {labels.get(key) or escape_markdown(key)}: {percent}%\n")
+        else:
+            parts.append(f"• {labels.get(key) or escape_markdown(key)}: {escape_markdown(value)}\n")
+
 def format_personality_report(analysis_data: dict) -> str:
-    """Format personality analysis results in Persian"""
-    
-    personality_traits = analysis_data.get('personality_traits', {})
-    emotional_state = analysis_data.get('emotional_state', {})
-    overall_assessment = analysis_data.get('overall_assessment', '')
-    
-    report = "✨ **نتیجه تحلیل جادویی شخصیت شما!** 🎭\n\n"
-    
-    # Personality traits section
+    """Format personality analysis results in Persian
+
+    Only model-sourced text (the overall assessment and unknown keys or values)
+    is escaped; the VIP sections come from local templates.
+    """
+    parts = [REPORT_TITLE]
+
+    personality_traits = analysis_data.get('personality_traits')
     if personality_traits:
-        report += "🧠 **ویژگی‌های شخصیتی شما:**\n"
-        
-        trait_descriptions = {
-            'extraversion': '🎉 برون‌گرایی',
-            'openness': '🌈 انعطاف‌پذیری',
-            'conscientiousness': '📋 وظیفه‌شناسی',
-            'agreeableness': '🤝 توافق‌پذیری',
-            'neuroticism': '😟 نوروز‌گرایی',
-            'confidence': '💪 اعتماد به نفس',
-            'creativity': '🎨 خلاقیت',
-            'leadership': '👑 رهبری',
-            'empathy': '❤️ همدلی'
-        }
-        
-        for trait, value in personality_traits.items():
-            persian_name = trait_descriptions.get(trait, trait)
-            if isinstance(value, (int, float)):
-                percentage = int(value * 100) if value <= 1 else int(value)
-                report += f"• {persian_name}: {percentage}%\n"
-            else:
-                report += f"• {persian_name}: {value}\n"
-        
-        report += "\n"
-    
-    # Emotional state section
+        parts.append(PERSONALITY_HEADER)
+        _append_percentages(parts, personality_traits, TRAIT_LABELS, TRAIT_LINES)
+        parts.append("\n")
+
+    emotional_state = analysis_data.get('emotional_state')
     if emotional_state:
-        report += "😊 **وضعیت عاطفی:**\n"
-        
-        emotion_descriptions = {
-            'happiness': 'شادی',
-            'sadness': 'غم',
-            'anger': 'خشم',
-            'fear': 'ترس',
-            'surprise': 'تعجب',
-            'disgust': 'انزجار',
-            'neutral': 'خنثی',
-            'stress_level': 'سطح استرس',
-            'energy_level': 'سطح انرژی'
-        }
-        
-        for emotion, value in emotional_state.items():
-            persian_name = emotion_descriptions.get(emotion, emotion)
-            if isinstance(value, (int, float)):
-                percentage = int(value * 100) if value <= 1 else int(value)
-                report += f"• {persian_name}: {percentage}%\n"
-            else:
-                report += f"• {persian_name}: {value}\n"
-        
-        report += "\n"
-    
-    # Overall assessment
+        parts.append(EMOTION_HEADER)
+        _append_percentages(parts, emotional_state, EMOTION_LABELS, EMOTION_LINES)
+        parts.append("\n")
+
+    overall_assessment = analysis_data.get('overall_assessment')
     if overall_assessment:
-        report += "📝 **ارزیابی کلی:**\n"
-        report += f"{overall_assessment}\n\n"
-    
-    # VIP features if available
-    if 'advanced_traits' in analysis_data:
-        report += "🎯 **ویژگی‌های پیشرفته (VIP):**\n"
-        advanced_traits = analysis_data['advanced_traits']
-        
-        vip_descriptions = {
-            'intelligence_quotient': '🧠 ضریب هوشی',
-            'emotional_intelligence': '💝 هوش عاطفی', 
-            'charisma_level': '✨ جذابیت شخصی',
-            'business_acumen': '💼 هوش تجاری',
-            'artistic_talent': '🎨 استعداد هنری',
-            'leadership_potential': '👑 پتانسیل رهبری'
-        }
-        
-        for trait, value in advanced_traits.items():
-            persian_name = vip_descriptions.get(trait, trait)
-            report += f"• {persian_name}: {value}% \n"
-        
-        report += "\n"
-    
-    # Life patterns for VIP
-    if 'life_patterns' in analysis_data:
-        report += "🔮 **الگوهای زندگی (VIP):**\n"
-        life_patterns = analysis_data['life_patterns']
-        
-        pattern_descriptions = {
-            'risk_tolerance': '⚡ تحمل ریسک',
-            'decision_style': '🎯 سبک تصمیم‌گیری',
-            'social_preference': '👥 ترجیح اجتماعی',
-            'work_style': '💪 سبک کاری'
-        }
-        
-        for pattern, value in life_patterns.items():
-            persian_name = pattern_descriptions.get(pattern, pattern)
-            report += f"• {persian_name}: {value}\n"
-        
-        report += "\n"
-    
-    # VIP assessments
-    if 'career_guidance' in analysis_data:
-        report += "💼 **راهنمایی شغلی (VIP):**\n"
-        report += f"{analysis_data['career_guidance']}\n\n"
-    
-    if 'relationship_insights' in analysis_data:
-        report += "💕 **بینش روابط (VIP):**\n"
-        report += f"{analysis_data['relationship_insights']}\n\n"
-    
-    if 'success_factors' in analysis_data:
-        report += "🎯 **عوامل موفقیت (VIP):**\n"
-        report += f"{analysis_data['success_factors']}\n\n"
-    
-    # Disclaimer
+        parts.append(f"{ASSESSMENT_HEADER}{escape_markdown(overall_assessment)}\n\n")
+
+    advanced_traits = analysis_data.get('advanced_traits')
+    if advanced_traits:
+        parts.append(ADVANCED_TRAITS_HEADER)
+        for key, value in advanced_traits.items():
+            key_lines = VIP_TRAIT_LINES.get(key)
+            if key_lines is not None and type(value) is int and 0 <= value <= 100:
+                parts.append(key_lines[value])
+            else:
+                parts.append(f"• {VIP_TRAIT_LABELS.get(key) or escape_markdown(key)}: {value}% \n")
+        parts.append("\n")
+
+    life_patterns = analysis_data.get('life_patterns')
+    if life_patterns:
+        parts.append(LIFE_PATTERNS_HEADER)
+        for key, value in life_patterns.items():
+            parts.append(f"{LIFE_PATTERN_PREFIXES.get(key) or f'• {escape_markdown(key)}: '}{value}\n")
+        parts.append("\n")
+
+    for key, header in (('career_guidance', CAREER_HEADER),
+                        ('relationship_insights', RELATIONSHIP_HEADER),
+                        ('success_factors', SUCCESS_HEADER)):
+        text = analysis_data.get(key)
+        if text:
+            parts.append(f"{header}{text}\n\n")
+
     if 'advanced_traits' in analysis_data:
-        report += "👑 **تبریک! شما عضو VIP هستید و از تحلیل‌های تخصصی بهره می‌برید.**\n\n"
-    
-    report += "⚠️ **توجه:** این تحلیل بر اساس ویژگی‌های ظاهری چهره انجام شده و صرفاً جنبه تفریحی دارد. برای ارزیابی دقیق شخصیت به متخصصان مراجعه کنید."
-    
-    return report
+        parts.append(VIP_FOOTER)
+    parts.append(DISCLAIMER)
+    return "".join(parts)
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Split text into messages within Telegram's length limit, preferring paragraph and line breaks"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip("\n"))
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+ERROR_MESSAGES = MappingProxyType({
+    'no_face': '🔍 اوه! تو عکس چهره‌ای پیدا نکردم! 😅\n📸 یه عکس واضح از خودت بفرست تا بتونم شخصیتت رو بخونم! ✨',
+    'multiple_faces': '👥 وای! چندتا چهره تو عکس دیدم! 😊\n👤 لطفاً یه عکس فقط از خودت بفرست تا روی تو تمرکز کنم! 💫',
+    'poor_quality': '📷 کیفیت عکس کمی ضعیفه عزیزم! 😔\n✨ یه عکس واضح‌تر و روشن‌تر بفرست تا بهتر تحلیلت کنم! 📸',
+    'file_too_large': '📊 حجم عکست خیلی زیاده! 😅\n💾 لطفاً عکسی کمتر از ۱۰ مگابایت بفرست! 🔄',
+    'unsupported_format': '🖼️ این فرمت عکس رو نمی‌شناسم! 😊\n📱 لطفاً عکست رو به فرمت JPG یا PNG بفرست! ✅',
+    'analysis_failed': '🔮 اوپس! یه مشکل کوچولو پیش اومد! 😅\n🔄 دوباره امتحان کن، حتماً این بار جواب میده! 💪',
+    'rate_limit': '⏰ عزیزم، یکم عجله داری! 😊\n🕐 {} ثانیه دیگه صبر کن، بعدش دوباره عکست رو بفرست! ⏳',
+    'api_error': '🌐 یه مشکل موقت با سرور پیش اومد! 😔\n🔄 چند دقیقه دیگه دوباره تلاش کن! ⭐',
+    'server_busy': '🚦 الان سرم خیلی شلوغه! 😅\n⏳ چند لحظه دیگه دوباره عکست رو بفرست! 📸',
+    'processing_error': '⚡ مشکلی تو پردازش عکس بود! 😅\n📸 یه عکس دیگه امتحان کن، حتماً این بار موفق می‌شیم! 🎯'
+})
 
 def get_error_message(error_type: str) -> str:
     """Get error messages in Persian"""
-    error_messages = {
-        'no_face': '🔍 اوه! تو عکس چهره‌ای پیدا نکردم! 😅\n📸 یه عکس واضح از خودت بفرست تا بتونم شخصیتت رو بخونم! ✨',
-        'multiple_faces': '👥 وای! چندتا چهره تو عکس دیدم! 😊\n👤 لطفاً یه عکس فقط از خودت بفرست تا روی تو تمرکز کنم! 💫',
-        'poor_quality': '📷 کیفیت عکس کمی ضعیفه عزیزم! 😔\n✨ یه عکس واضح‌تر و روشن‌تر بفرست تا بهتر تحلیلت کنم! 📸',
-        'file_too_large': '📊 حجم عکست خیلی زیاده! 😅\n💾 لطفاً عکسی کمتر از ۱۰ مگابایت بفرست! 🔄',
-        'unsupported_format': '🖼️ این فرمت عکس رو نمی‌شناسم! 😊\n📱 لطفاً عکست رو به فرمت JPG یا PNG بفرست! ✅',
-        'analysis_failed': '🔮 اوپس! یه مشکل کوچولو پیش اومد! 😅\n🔄 دوباره امتحان کن، حتماً این بار جواب میده! 💪',
-        'rate_limit': '⏰ عزیزم، یکم عجله داری! 😊\n🕐 {} ثانیه دیگه صبر کن، بعدش دوباره عکست رو بفرست! ⏳',
-        'api_error': '🌐 یه مشکل موقت با سرور پیش اومد! 😔\n🔄 چند دقیقه دیگه دوباره تلاش کن! ⭐',
-        'processing_error': '⚡ مشکلی تو پردازش عکس بود! 😅\n📸 یه عکس دیگه امتحان کن، حتماً این بار موفق می‌شیم! 🎯'
-    }
-    
-    return error_messages.get(error_type, '❌ خطای نامشخص رخ داده است.')
+    return ERROR_MESSAGES.get(error_type, '❌ خطای نامشخص رخ داده است.')
 
 def get_subscription_offer_message() -> str:
     """پیام تشویق برای خرید اشتراک"""
@@ -221,14 +256,22 @@ def get_welcome_message() -> str:
 
 💎 **از منوی زیر گزینه مورد نظرتان را انتخاب کنید:** 👇"""
 
+# Main menu buttons, the bot routes menu presses by these texts
+MENU_ANALYZE = "📸 تحلیل شخصیت"
+MENU_VIP = "👑 اشتراک VIP"
+MENU_STATUS = "📊 وضعیت من"
+MENU_HELP = "❓ راهنما"
+MENU_SUPPORT = "📞 پشتیبانی"
+MENU_ABOUT = "🎯 درباره ربات"
+
 def get_main_menu_keyboard():
     """منوی اصلی با دکمه‌های شیشه‌ای"""
     from telegram import ReplyKeyboardMarkup, KeyboardButton
     
     keyboard = [
-        [KeyboardButton("📸 تحلیل شخصیت"), KeyboardButton("👑 اشتراک VIP")],
-        [KeyboardButton("📊 وضعیت من"), KeyboardButton("❓ راهنما")],
-        [KeyboardButton("📞 پشتیبانی"), KeyboardButton("🎯 درباره ربات")]
+        [KeyboardButton(MENU_ANALYZE), KeyboardButton(MENU_VIP)],
+        [KeyboardButton(MENU_STATUS), KeyboardButton(MENU_HELP)],
+        [KeyboardButton(MENU_SUPPORT), KeyboardButton(MENU_ABOUT)]
     ]
     
     return ReplyKeyboardMarkup(
@@ -238,6 +281,27 @@ def get_main_menu_keyboard():
         input_field_placeholder="از منو انتخاب کنید..."
     )
 
+def get_photo_prompt_message() -> str:
+    """پیام آمادگی برای ارسال عکس"""
+    return """📸 **آماده تحلیل شخصیت هستید!** ✨
+
+🎯 **مراحل انجام:**
+📷 عکس واضح از چهره‌تان بفرستید
+✨ مطمئن شوید عکس با کیفیت و روشن باشد
+👤 فقط یک چهره در تصویر باشد
+
+🚀 **الان عکستان را بفرستید!** 💫"""
+
+def get_menu_hint_message() -> str:
+    """پیام راهنمای استفاده از منو"""
+    return """📱 **از منوی زیر انتخاب کنید:** 👇
+
+💡 روی دکمه‌های منو کلیک کنید تا به بخش مورد نظر بروید."""
+
+def get_already_vip_message() -> str:
+    """پیام برای کاربری که اشتراک VIP فعال دارد"""
+    return "👑 **شما الان عضو VIP هستید!** ✨\n\n📸 می‌تونید عکس‌هاتون رو بفرستید و از تحلیل‌های کامل استفاده کنید! 💎"
+
 def get_help_message() -> str:
     """پیام راهنما"""
     return """📖 **راهنمای استفاده از ربات** 
@@ -360,3 +424,24 @@ def get_status_message(is_vip: bool, has_used_free: bool, vip_expires=None) -> s
 def get_processing_message() -> str:
     """Get processing message in Persian"""
     return "🔮 **جادو شروع شد! در حال تحلیل چهره‌تان...** ✨\n\n🧠 دارم ویژگی‌های شخصیتی‌تان رو میخونم...\n💫 صبر کنید تا نتیجه جالب رو ببینید!"
+
+class MessageCatalog:
+    """Static replies and the main menu keyboard, built once at startup and shared by all handlers"""
+
+    def __init__(self):
+        self.main_menu_keyboard = get_main_menu_keyboard()
+        self.welcome = get_welcome_message()
+        self.processing = get_processing_message()
+        self.subscription_offer = get_subscription_offer_message()
+        self.vip_purchase = get_vip_purchase_message()
+        self.already_used_free = get_already_used_free_message()
+        self.already_vip = get_already_vip_message()
+        self.menu_hint = get_menu_hint_message()
+
+        # Menu buttons answered with a fixed text
+        self.menu_replies = MappingProxyType({
+            MENU_ANALYZE: get_photo_prompt_message(),
+            MENU_HELP: get_help_message(),
+            MENU_ABOUT: get_about_message(),
+            MENU_SUPPORT: get_support_message()
+        })
@@ -1,27 +1,37 @@
+import asyncio
 import json
+import logging
 import os
-from openai import OpenAI
+import random
+import re
+import time
+import openai
+from openai import OpenAI, AsyncOpenAI
 from typing import Dict, Any
+from config import (
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_TIMEOUT,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_BASE_DELAY,
+    VISION_PAYLOAD_MODE,
+    VISION_IMAGE_DETAIL,
+    RESPONSE_CACHE_ENABLED,
+    ANALYSIS_LATENCY_BUDGET
+)
+from response_cache import ResponseCache
+from circuit_breaker import CircuitBreaker
 
-class PersonalityAnalyzer:
-    def __init__(self):
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if openai_key:
-            self.openai_client = OpenAI(api_key=openai_key)
-        else:
-            self.openai_client = None
-    
-    def analyze_personality(self, base64_image: str, face_features: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Analyze personality traits from facial features using OpenAI vision model
-        """
-        # اگر کلید OpenAI نداریم، از تحلیل ساده استفاده می‌کنیم
-        if not self.openai_client:
-            return self._get_simple_analysis(face_features)
-        
-        try:
-            # Prepare the analysis prompt in Persian
-            system_prompt = """شما یک متخصص روانشناسی و تحلیل چهره هستید. وظیفه شما تحلیل ویژگی‌های شخصیتی و وضعیت عاطفی افراد بر اساس ویژگی‌های چهره آنهاست.
+logger = logging.getLogger(__name__)
+
+# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+# do not change this unless explicitly requested by the user
+VISION_MODEL = "gpt-4o"
+
+# Bump whenever the prompts change, so cached responses from the old prompt are not reused
+PROMPT_VERSION = "1"
+
+# Prompt for the analysis, in Persian
+ANALYSIS_SYSTEM_PROMPT = """شما یک متخصص روانشناسی و تحلیل چهره هستید. وظیفه شما تحلیل ویژگی‌های شخصیتی و وضعیت عاطفی افراد بر اساس ویژگی‌های چهره آنهاست.
 
 بر اساس تصویر ارائه شده، ویژگی‌های زیر را تحلیل کنید:
 
@@ -62,45 +72,83 @@ class PersonalityAnalyzer:
   "overall_assessment": "متن ارزیابی کلی به فارسی"
 }"""
 
-            user_prompt = f"""لطفاً این تصویر چهره را تحلیل کنید و ویژگی‌های شخصیتی و عاطفی فرد را استخراج کنید.
+# Errors worth retrying in the async path
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError
+)
 
-اطلاعات تکمیلی از تحلیل تصویر:
-- ابعاد چهره: {face_features.get('face_dimensions', 'نامشخص')}
-- تعداد چشم‌های شناسایی شده: {face_features.get('eye_count', 0)}
-- لبخند شناسایی شده: {'بله' if face_features.get('smile_detected', False) else 'خیر'}
-- نسبت عرض به ارتفاع چهره: {face_features.get('face_width_height_ratio', 0):.2f}
-- میزان روشنایی: {face_features.get('brightness', 0):.1f}
-- میزان کنتراست: {face_features.get('contrast', 0):.1f}
+# Marks results that stand in for a failed model call; they must not be cached
+DEGRADED_KEY = '_degraded'
 
-بر اساس این اطلاعات و تحلیل بصری تصویر، ارزیابی دقیق و معنی‌داری ارائه دهید."""
+def split_degraded(result: Dict[str, Any]):
+    """Return (result without the degraded marker, whether it was degraded)"""
+    if not result.get(DEGRADED_KEY):
+        return result, False
+    return {key: value for key, value in result.items() if key != DEGRADED_KEY}, True
+
+# Top-level sections of the model's JSON answer, in the order the prompt asks for them
+STREAMED_SECTIONS = ('personality_traits', 'emotional_state', 'overall_assessment')
+
+_json_decoder = json.JSONDecoder()
 
-            # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-            # do not change this unless explicitly requested by the user
+# Caps concurrent vision calls across all users of this process
+_openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+class PersonalityAnalyzer:
+    def __init__(self, max_concurrency: int = None):
+        openai_key = os.getenv("OPENAI_API_KEY")
+        if openai_key:
+            self.openai_client = OpenAI(api_key=openai_key)
+            # Retries are handled in analyze_personality_async
+            self.async_openai_client = AsyncOpenAI(api_key=openai_key, max_retries=0)
+        else:
+            self.openai_client = None
+            self.async_openai_client = None
+        
+        self.circuit_breaker = CircuitBreaker('vision-api')
+        # Offline jobs pass their own limit, the bot shares the process-wide one
+        self.openai_slots = asyncio.Semaphore(max_concurrency) if max_concurrency else _openai_semaphore
+        
+        self.response_cache = None
+        if self.openai_client and RESPONSE_CACHE_ENABLED:
+            try:
+                self.response_cache = ResponseCache()
+            except Exception as e:
+                logger.error(f"Vision response cache disabled: {e}")
+    
+    def analyze_personality(self, base64_image: str, face_features: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Analyze personality traits from facial features using OpenAI vision model
+        """
+        # اگر کلید OpenAI نداریم، از تحلیل ساده استفاده می‌کنیم
+        if not self.openai_client:
+            return self._get_simple_analysis(face_features)
+        
+        cache_key = self._response_cache_key(base64_image)
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        try:
+            started = time.perf_counter()
             response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user", 
-                        "content": [
-                            {"type": "text", "text": user_prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
-                    }
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=1500,
-                temperature=0.7
+                **self._build_completion_request(base64_image, face_features)
             )
+            self._log_vision_call(base64_image, started)
             
             # Parse the JSON response
             analysis_result = json.loads(response.choices[0].message.content)
             
             # Validate and clean the response
-            return self._validate_analysis_result(analysis_result)
+            validated = self._validate_analysis_result(analysis_result)
+            if cache_key:
+                self.response_cache.put(cache_key, validated)
+            return validated
             
         except json.JSONDecodeError as e:
             print(f"JSON parsing error: {e}")
@@ -109,6 +157,177 @@ class PersonalityAnalyzer:
             print(f"OpenAI API error: {e}")
             return self._get_fallback_analysis()
     
+    async def analyze_personality_async(self, base64_image: str, face_features: Dict[str, Any],
+                                        on_partial=None) -> Dict[str, Any]:
+        """
+        Async version of analyze_personality for the bot's event loop.
+        Calls are bounded by a semaphore (process-wide unless max_concurrency was given),
+        time out after OPENAI_TIMEOUT and transient errors are retried with jittered exponential backoff.
+        With on_partial, the completion is streamed and on_partial(result) is called
+        every time another section of the answer becomes complete. It must not block:
+        it runs inside the timed model call while a vision slot is held.
+        When the call fails, the circuit breaker is open or ANALYSIS_LATENCY_BUDGET runs out, the local
+        feature-based analysis is returned instead, marked with DEGRADED_KEY.
+        """
+        if not self.async_openai_client:
+            return self._get_simple_analysis(face_features)
+        
+        cache_key = self._response_cache_key(base64_image)
+        if cache_key:
+            cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is not None:
+                return cached
+        
+        try:
+            return await asyncio.wait_for(
+                self._request_analysis(base64_image, face_features, on_partial, cache_key),
+                ANALYSIS_LATENCY_BUDGET
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Vision analysis exceeded the {ANALYSIS_LATENCY_BUDGET}s budget, using local analysis")
+            return self._get_degraded_analysis(face_features)
+    
+    async def _request_analysis(self, base64_image: str, face_features: Dict[str, Any],
+                                on_partial, cache_key) -> Dict[str, Any]:
+        """Call the vision model with retries, guarded by the circuit breaker"""
+        request = self._build_completion_request(base64_image, face_features)
+        
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            if not self.circuit_breaker.allow():
+                logger.warning("Vision API circuit is open, using local analysis")
+                return self._get_degraded_analysis(face_features)
+            
+            try:
+                async with self.openai_slots:
+                    started = time.perf_counter()
+                    try:
+                        if on_partial:
+                            content = await asyncio.wait_for(
+                                self._stream_completion(request, on_partial),
+                                OPENAI_TIMEOUT
+                            )
+                        else:
+                            response = await asyncio.wait_for(
+                                self.async_openai_client.chat.completions.create(**request),
+                                OPENAI_TIMEOUT
+                            )
+                            content = response.choices[0].message.content
+                    except BaseException:
+                        # Includes cancellation by the latency budget
+                        self.circuit_breaker.record_failure()
+                        raise
+                    self.circuit_breaker.record_success(time.perf_counter() - started)
+                    self._log_vision_call(base64_image, started)
+                
+                analysis_result = json.loads(content)
+                validated = self._validate_analysis_result(analysis_result)
+                if cache_key:
+                    await asyncio.to_thread(self.response_cache.put, cache_key, validated)
+                return validated
+                
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON parsing error: {e}")
+                return self._get_degraded_analysis(face_features)
+            except RETRYABLE_ERRORS as e:
+                logger.warning(f"OpenAI API error (attempt {attempt + 1}/{OPENAI_MAX_RETRIES + 1}): {e!r}")
+                if attempt < OPENAI_MAX_RETRIES:
+                    # Full jitter keeps retries from many users from arriving in lockstep
+                    await asyncio.sleep(random.uniform(0, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+            except Exception as e:
+                logger.error(f"OpenAI API error: {e}")
+                break
+        
+        logger.warning("Vision analysis failed, using local analysis")
+        return self._get_degraded_analysis(face_features)
+    
+    async def _stream_completion(self, request: Dict[str, Any], on_partial) -> str:
+        """Stream the completion, reporting each section as soon as it parses"""
+        stream = await self.async_openai_client.chat.completions.create(**request, stream=True)
+        chunks = []
+        sections = {}
+        
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            delta = chunk.choices[0].delta.content
+            chunks.append(delta)
+            
+            # A section can only have just completed when a closing character arrives
+            if '}' in delta or '"' in delta:
+                if self._parse_partial_sections(''.join(chunks), sections):
+                    on_partial(self._validate_analysis_result(sections))
+        
+        return ''.join(chunks)
+    
+    def _parse_partial_sections(self, text: str, sections: Dict[str, Any]) -> bool:
+        """Add the sections that are complete in the partial JSON text, return True if any were new"""
+        found_new = False
+        for key in STREAMED_SECTIONS:
+            if key in sections:
+                continue
+            match = re.search(rf'"{key}"\s*:\s*', text)
+            if not match:
+                continue
+            try:
+                sections[key], _ = _json_decoder.raw_decode(text, match.end())
+                found_new = True
+            except json.JSONDecodeError:
+                pass  # Section still streaming
+        return found_new
+    
+    def _response_cache_key(self, base64_image: str):
+        """Persistent cache key for this image, or None when the cache is off"""
+        if not self.response_cache or not base64_image:
+            return None
+        return ResponseCache.make_key(base64_image, PROMPT_VERSION, VISION_MODEL)
+    
+    def _build_completion_request(self, base64_image: str, face_features: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chat completion arguments shared by the sync and async paths
+        
+        Without base64_image only the feature description is sent (used for offline re-analysis).
+        """
+        content = [{"type": "text", "text": self._build_user_prompt(face_features)}]
+        if base64_image:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{base64_image}",
+                    "detail": VISION_IMAGE_DETAIL
+                }
+            })
+        
+        return {
+            'model': VISION_MODEL,
+            'messages': [
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            'response_format': {"type": "json_object"},
+            'max_tokens': 1500,
+            'temperature': 0.7
+        }
+    
+    def _log_vision_call(self, base64_image: str, started: float):
+        """Log payload size and latency so payload modes can be compared"""
+        latency_ms = (time.perf_counter() - started) * 1000
+        payload_kb = len(base64_image or '') * 3 / 4 / 1024
+        logger.info(f"Vision call: payload {payload_kb:.0f} KiB ({VISION_PAYLOAD_MODE}, detail={VISION_IMAGE_DETAIL}), "
+                    f"latency {latency_ms:.0f} ms")
+    
+    def _build_user_prompt(self, face_features: Dict[str, Any]) -> str:
+        """Prompt text describing the locally detected face features"""
+        return f"""لطفاً این تصویر چهره را تحلیل کنید و ویژگی‌های شخصیتی و عاطفی فرد را استخراج کنید.
+
+اطلاعات تکمیلی از تحلیل تصویر:
+- ابعاد چهره: {face_features.get('face_dimensions', 'نامشخص')}
+- تعداد چشم‌های شناسایی شده: {face_features.get('eye_count', 0)}
+- لبخند شناسایی شده: {'بله' if face_features.get('smile_detected', False) else 'خیر'}
+- نسبت عرض به ارتفاع چهره: {face_features.get('face_width_height_ratio', 0):.2f}
+- میزان روشنایی: {face_features.get('brightness', 0):.1f}
+- میزان کنتراست: {face_features.get('contrast', 0):.1f}
+
+بر اساس این اطلاعات و تحلیل بصری تصویر، ارزیابی دقیق و معنی‌داری ارائه دهید."""
+    
     def _get_simple_analysis(self, face_features: Dict[str, Any]) -> Dict[str, Any]:
         """تحلیل ساده بر اساس ویژگی‌های چهره بدون استفاده از OpenAI"""
         import random
@@ -147,6 +366,12 @@ class PersonalityAnalyzer:
             'overall_assessment': self._generate_persian_assessment(smile_detected, brightness, face_ratio)
         }
     
+    def _get_degraded_analysis(self, face_features: Dict[str, Any]) -> Dict[str, Any]:
+        """Local analysis standing in for a failed model call"""
+        result = self._get_simple_analysis(face_features)
+        result[DEGRADED_KEY] = True
+        return result
+    
     def _generate_persian_assessment(self, has_smile: bool, brightness: float, face_ratio: float) -> str:
         """تولید ارزیابی فارسی بر اساس ویژگی‌های چهره"""
         assessments = []
@@ -169,7 +394,16 @@ class PersonalityAnalyzer:
     def get_vip_analysis(self, base64_image: str, face_features: Dict[str, Any]) -> Dict[str, Any]:
         """تحلیل کامل VIP با جزئیات بیشتر"""
         basic_analysis = self._get_simple_analysis(face_features)
-        
+        return self._add_vip_sections(basic_analysis, face_features)
+    
+    async def get_vip_analysis_async(self, base64_image: str, face_features: Dict[str, Any],
+                                     on_partial=None) -> Dict[str, Any]:
+        """تحلیل کامل VIP با مدل تصویری (در صورت وجود کلید OpenAI)"""
+        basic_analysis = await self.analyze_personality_async(base64_image, face_features, on_partial)
+        return self._add_vip_sections(basic_analysis, face_features)
+    
+    def _add_vip_sections(self, basic_analysis: Dict[str, Any], face_features: Dict[str, Any]) -> Dict[str, Any]:
+        """افزودن بخش‌های VIP به تحلیل پایه"""
         # افزودن ویژگی‌های VIP خاص
         vip_features = self._get_vip_features(face_features)
         basic_analysis.update(vip_features)
@@ -297,5 +531,6 @@ class PersonalityAnalyzer:
                 'energy_level': 0.5,
                 'stress_level': 0.3
             },
-            'overall_assessment': 'متأسفانه در حال حاضر قادر به انجام تحلیل دقیق نیستم. لطفاً بعداً مجدداً تلاش کنید.'
+            'overall_assessment': 'متأسفانه در حال حاضر قادر به انجام تحلیل دقیق نیستم. لطفاً بعداً مجدداً تلاش کنید.',
+            DEGRADED_KEY: True
         }
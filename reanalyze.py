@@ -0,0 +1,191 @@
+"""Offline re-analysis of stored results in analysis_history
+
+Streams history rows in chunks, runs the current analyzer on the stored face
+features and writes old and new results side by side to a JSONL file, then
+reports throughput and per-trait drift between the two versions.
+
+Usage:
+    python reanalyze.py --mode heuristic --output rescore.jsonl
+    python reanalyze.py --mode model --base-url http://localhost:8000/v1 --output rescore.jsonl
+
+Rows saved before face features were stored with the analysis are skipped, as are
+rows whose stored result was a local stand-in for a failed model call. In model
+mode, rows the analyzer could only answer with such a stand-in are counted as
+failed and left out of the output and the drift figures.
+Heuristic mode scores each chunk in one vectorized batch, seeded by the row id,
+so re-running it over the same rows gives the same scores.
+The model path sends the feature description without the image, since photos
+are not kept; point --base-url at a local mock endpoint to test prompt changes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+from models import SessionLocal, AnalysisHistory
+from analysis_codec import decode_analysis
+from personality_analyzer import DEGRADED_KEY, split_degraded
+
+SCORED_SECTIONS = ('personality_traits', 'emotional_state')
+
+class HistoryRow(NamedTuple):
+    id: int
+    user_telegram_id: int
+    analysis_type: str
+    analysis: dict
+
+def iter_history_chunks(chunk_size: int, start_id: int = 0, limit: int = None):
+    """Yield lists of decoded analysis_history rows in id order, one short session per chunk"""
+    last_id = start_id
+    seen = 0
+    while limit is None or seen < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - seen)
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                AnalysisHistory.id,
+                AnalysisHistory.user_telegram_id,
+                AnalysisHistory.analysis_type,
+                AnalysisHistory.analysis_data
+            ).filter(AnalysisHistory.id > last_id).order_by(AnalysisHistory.id).limit(size).all()
+            rows = [
+                HistoryRow(row.id, row.user_telegram_id, row.analysis_type, decode_analysis(db, row.analysis_data))
+                for row in rows
+            ]
+        finally:
+            db.close()
+
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+        seen += len(rows)
+
+class DriftReport:
+    """Mean absolute difference per trait between stored and new results"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, old: dict, new: dict):
+        for section in SCORED_SECTIONS:
+            old_values = old.get(section, {})
+            for key, value in new.get(section, {}).items():
+                if isinstance(old_values.get(key), (int, float)) and isinstance(value, (int, float)):
+                    self.totals[key] += abs(value - old_values[key])
+                    self.counts[key] += 1
+
+    def summary(self) -> dict:
+        return {key: round(self.totals[key] / self.counts[key], 4) for key in sorted(self.counts)}
+
+class AnalysisFailed(Exception):
+    """The analyzer fell back to a local stand-in instead of the model's answer"""
+
+async def reanalyze_row(analyzer, row):
+    """Re-run the model analysis for one stored row, new result is None if it has no face features
+
+    Raises AnalysisFailed when the model call failed and the analyzer fell back.
+    """
+    old_result = row.analysis
+    face_features = old_result.get('face_features')
+    if not face_features or old_result.get(DEGRADED_KEY):
+        return old_result, None
+    new_result, degraded = split_degraded(await analyzer.analyze_personality_async(None, face_features))
+    if degraded:
+        raise AnalysisFailed(f"row {row.id}")
+    return old_result, new_result
+
+def reanalyze_chunk_heuristic(engine, rows) -> list:
+    """Re-score a chunk of rows in one batch, returns (old, new) per row like reanalyze_row"""
+    old_results = [row.analysis for row in rows]
+    scored = [i for i, old_result in enumerate(old_results)
+              if old_result.get('face_features') and not old_result.get(DEGRADED_KEY)]
+    new_results = engine.analyze_batch(
+        [old_results[i]['face_features'] for i in scored],
+        seeds=[rows[i].id for i in scored]
+    )
+
+    outcomes = [(old_result, None) for old_result in old_results]
+    for i, new_result in zip(scored, new_results):
+        outcomes[i] = (old_results[i], new_result)
+    return outcomes
+
+async def run(args):
+    if args.base_url:
+        # The OpenAI client picks these up, a mock endpoint doesn't check the key
+        os.environ['OPENAI_BASE_URL'] = args.base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'mock')
+
+    from personality_analyzer import PersonalityAnalyzer
+    from heuristic_engine import HeuristicEngine
+    analyzer = PersonalityAnalyzer(max_concurrency=args.parallelism)
+    engine = HeuristicEngine(analyzer)
+    if args.mode == 'model' and not analyzer.async_openai_client:
+        raise SystemExit("Model mode needs OPENAI_API_KEY or --base-url")
+
+    slots = asyncio.Semaphore(args.parallelism)
+    drift = DriftReport()
+    processed = skipped = failed = 0
+    started = time.perf_counter()
+
+    async def bounded(row):
+        async with slots:
+            return await reanalyze_row(analyzer, row)
+
+    async def reanalyze_chunk(rows):
+        if args.mode == 'heuristic':
+            return reanalyze_chunk_heuristic(engine, rows)
+        return await asyncio.gather(*(bounded(row) for row in rows), return_exceptions=True)
+
+    with open(args.output, 'w', encoding='utf-8') as output:
+        for rows in iter_history_chunks(args.chunk_size, args.start_id, args.limit):
+            for row, outcome in zip(rows, await reanalyze_chunk(rows)):
+                if isinstance(outcome, AnalysisFailed):
+                    failed += 1
+                    continue
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                old_result, new_result = outcome
+                if new_result is None:
+                    skipped += 1
+                    continue
+                processed += 1
+                drift.add(old_result, new_result)
+                output.write(json.dumps({
+                    'id': row.id,
+                    'user_telegram_id': row.user_telegram_id,
+                    'analysis_type': row.analysis_type,
+                    'old': {section: old_result.get(section, {}) for section in SCORED_SECTIONS},
+                    'new': new_result
+                }, ensure_ascii=False) + "\n")
+
+            elapsed = time.perf_counter() - started
+            print(f"up to id {rows[-1].id}: {processed} re-analyzed, {skipped} skipped, {failed} failed, "
+                  f"{processed / elapsed:.1f} rows/s")
+
+    elapsed = time.perf_counter() - started
+    print()
+    print(f"re-analyzed {processed} rows in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} rows/s), "
+          f"skipped {skipped} rows without face features or with a degraded stored result, "
+          f"{failed} rows failed")
+    print("mean absolute drift per trait:")
+    for key, value in drift.summary().items():
+        print(f"  {key}: {value}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run personality analysis over analysis_history")
+    parser.add_argument('--mode', choices=['heuristic', 'model'], default='heuristic')
+    parser.add_argument('--output', required=True, help="JSONL file for old and new results")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--parallelism', type=int, default=8, help="model analyses running at once")
+    parser.add_argument('--start-id', type=int, default=0, help="only rows with a larger id")
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--base-url', default=None, help="OpenAI-compatible endpoint, e.g. a local mock")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
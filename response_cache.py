@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """SQLite-backed cache of validated vision model results that survives restarts"""
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 ttl: int = RESPONSE_CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        # One connection shared by the event loop and worker threads, serialized by the lock
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS vision_responses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_vision_responses_accessed ON vision_responses (accessed_at)")
+
+    @staticmethod
+    def make_key(base64_image: str, prompt_version: str, model: str) -> str:
+        """Cache key from the normalized image payload, prompt version and model name"""
+        image_hash = hashlib.sha256(base64_image.encode('ascii')).hexdigest()
+        return hashlib.sha256(f"{image_hash}:{prompt_version}:{model}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached result or None"""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT result, created_at FROM vision_responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    if row is not None:
+                        self._db.execute("DELETE FROM vision_responses WHERE key = ?", (key,))
+                    self.misses += 1
+                    return None
+
+                self._db.execute("UPDATE vision_responses SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.error(f"Vision response cache read failed: {e}")
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, result: dict):
+        """Store a validated result and evict least recently used entries over the size limit"""
+        data = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO vision_responses (key, result, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data.encode('utf-8')), now, now)
+                )
+                self._evict(now)
+            except sqlite3.Error as e:
+                logger.error(f"Vision response cache write failed: {e}")
+
+    def _evict(self, now: float):
+        expired = self._db.execute("DELETE FROM vision_responses WHERE created_at < ?", (now - self.ttl,))
+        self.evictions += expired.rowcount
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM vision_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM vision_responses ORDER BY accessed_at"):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM vision_responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size, for sizing the cache"""
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM vision_responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total
+        }
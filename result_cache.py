@@ -0,0 +1,65 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from config import RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL, RESULT_CACHE_USE_DATABASE
+from async_models import get_cached_analysis, save_cached_analysis
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """LRU cache of finished analyses keyed by Telegram file_unique_id and analysis type"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl: int = RESULT_CACHE_TTL,
+                 use_database: bool = RESULT_CACHE_USE_DATABASE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_database = use_database
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, file_unique_id: str, analysis_type: str):
+        """Return the cached analysis result or None"""
+        key = (file_unique_id, analysis_type)
+        entry = self.entries.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if time.time() - stored_at < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self.entries[key]
+
+        if self.use_database:
+            result = await self._get_from_database(file_unique_id, analysis_type)
+            if result is not None:
+                self._remember(key, result)
+                self.hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    async def put(self, file_unique_id: str, analysis_type: str, result: dict):
+        """Store a finished analysis result"""
+        self._remember((file_unique_id, analysis_type), result)
+        if self.use_database:
+            try:
+                await save_cached_analysis(file_unique_id, analysis_type, json.dumps(result))
+            except Exception as e:
+                logger.error(f"Could not store cached analysis for {file_unique_id}: {e}")
+
+    def _remember(self, key, result: dict):
+        self.entries[key] = (time.time(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def _get_from_database(self, file_unique_id: str, analysis_type: str):
+        try:
+            analysis_data = await get_cached_analysis(file_unique_id, analysis_type, self.ttl)
+            return json.loads(analysis_data) if analysis_data else None
+        except Exception as e:
+            logger.error(f"Could not read cached analysis for {file_unique_id}: {e}")
+            return None
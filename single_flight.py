@@ -0,0 +1,38 @@
+import asyncio
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-progress call"""
+
+    def __init__(self):
+        self.calls = {}
+        self.shared_calls = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """Await func(*args, **kwargs), or the call already running for key"""
+        future = self.calls.get(key)
+        if future is not None:
+            self.shared_calls += 1
+            # shield: a cancelled waiter must not cancel the owner's call
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Waiters get an ordinary error they handle like any failed call;
+            # cancelling the future would cancel them too
+            future.set_exception(RuntimeError(f"shared call for {key!r} was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting, don't let asyncio log it as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            # Only in-progress calls are shared, a failure never sticks to the key
+            del self.calls[key]
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from config import USER_STATE_CACHE_MAX_ENTRIES, USER_STATE_CACHE_TTL
+
+class UserStateCache:
+    """Bounded LRU of UserState snapshots keyed by telegram_id
+
+    Entries live for ttl seconds, but never past the user's vip_expires, so an
+    expired subscription is always re-read. Writers that change a user's state
+    call invalidate(); upgrades made by another process show up within ttl.
+    """
+
+    def __init__(self, max_entries: int = USER_STATE_CACHE_MAX_ENTRIES, ttl: float = USER_STATE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # telegram_id -> (expires_at, UserState)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Per-user invalidation generations, so a write only blocks caching reads of that user.
+        # Users dropped from this bounded map fall back to generation_floor, which is raised
+        # to every dropped generation, so a read racing a dropped write is still never cached.
+        self.generations = OrderedDict()  # telegram_id -> invalidation number of the last write
+        self.generation_floor = 0
+        # The sync models functions may run in worker threads
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int):
+        """Return the cached UserState or None"""
+        with self._lock:
+            entry = self.entries.get(telegram_id)
+            if entry is not None:
+                expires_at, state = entry
+                if time.monotonic() < expires_at:
+                    self.entries.move_to_end(telegram_id)
+                    self.hits += 1
+                    return state
+                del self.entries[telegram_id]
+            self.misses += 1
+            return None
+
+    def put(self, state, read_token: int = None):
+        """Cache a snapshot read from the database
+
+        read_token is the user's generation taken before the read; if the user was
+        invalidated meanwhile, the snapshot may predate that write and is not cached.
+        """
+        ttl = self.ttl
+        if state.is_vip and state.vip_expires:
+            ttl = min(ttl, (state.vip_expires - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            if read_token is not None and read_token != self._generation(state.telegram_id):
+                return
+            self.entries[state.telegram_id] = (time.monotonic() + ttl, state)
+            self.entries.move_to_end(state.telegram_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, telegram_id: int):
+        """Drop a user's snapshot after their state changed"""
+        with self._lock:
+            self.entries.pop(telegram_id, None)
+            self.invalidations += 1
+            self.generations[telegram_id] = self.invalidations
+            self.generations.move_to_end(telegram_id)
+            while len(self.generations) > self.max_entries:
+                _, dropped = self.generations.popitem(last=False)
+                self.generation_floor = max(self.generation_floor, dropped)
+
+    def read_token(self, telegram_id: int) -> int:
+        """Take before reading a user's state from the database, pass to put()"""
+        with self._lock:
+            return self._generation(telegram_id)
+
+    def _generation(self, telegram_id: int) -> int:
+        return self.generations.get(telegram_id, self.generation_floor)
+
+    def stats(self) -> dict:
+        """Hit/miss counters, for checking how many lookups skip the database"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'entries': len(self.entries)
+        }
+
+# Shared by models.py and async_models.py so either writer invalidates the same entries
+user_state_cache = UserStateCache()